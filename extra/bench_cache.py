@@ -0,0 +1,70 @@
+"""
+Microbenchmark of loading parsed inputs from the on-disk cache against parsing them, run as `python -m extra.bench_cache`
+"""
+import pickle
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import Timer
+
+from extra.cache import MIN_CACHED_INPUT, dump_input, input_key
+from pre_definition.stdio import stdio
+
+ROW = '123456 654321 42 7\n'
+SIZES = [1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024]
+
+
+def read_ints():
+    return list(map(int, sys.stdin.read().split()))
+
+
+def read_rows():
+    return [list(map(int, line.split())) for line in sys.stdin]
+
+
+READERS = [
+    ('ints', read_ints),
+    ('rows', read_rows),
+]
+
+
+def parse(text, reader):
+    with stdio(input=text):
+        return reader()
+
+
+def load(text, inputdir: Path):
+    # the same work as a hit of `read_input`
+    with (inputdir / f'{input_key(text)}.pickle').open('rb') as f:
+        return pickle.load(f)
+
+
+def dump(text, parsed, inputdir: Path):
+    # the extra work of a miss of `read_input`
+    dump_input(parsed, inputdir, inputdir / f'{input_key(text)}.pickle')
+
+
+def best_of(func, size):
+    number = max(1, 1024 * 1024 // size)
+    return min(Timer(func).repeat(repeat=5, number=number)) / number
+
+
+def main():
+    print(f'inputs are cached from {MIN_CACHED_INPUT // 1024}KB', file=sys.__stdout__)
+    with TemporaryDirectory() as tmpdir:
+        inputdir = Path(tmpdir)
+        for name, reader in READERS:
+            for size in SIZES:
+                text = ROW * (size // len(ROW))
+                parsed = parse(text, reader), None
+
+                parsing = best_of(lambda: parse(text, reader), size)
+                dumping = best_of(lambda: dump(text, parsed, inputdir), size)
+                loading = best_of(lambda: load(text, inputdir), size)
+                print(f'{name:>5} {size // 1024:>5}KB: parse {parsing * 1e3:8.3f} msec, '
+                      f'dump {dumping * 1e3:8.3f} msec, load {loading * 1e3:8.3f} msec '
+                      f'(saves {(parsing - loading) * 1e3:8.3f} msec)', file=sys.__stdout__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Microbenchmark of `stdio` enter/exit cost, run as `python -m extra.bench_stdio`
+"""
+import sys
+from io import StringIO
+from timeit import Timer
+
+from pre_definition.stdio import install_context_stdio, stdio, uninstall_context_stdio
+
+NUMBER = 100_000
+SMALL = '1 2 3\n'
+LARGE = '1 2 3\n' * 100_000
+
+
+def enter_exit_input():
+    with stdio(input=SMALL):
+        pass
+
+
+def enter_exit_output():
+    with stdio(output=True) as cm:
+        pass
+    cm.output_get()
+
+
+def enter_exit_file():
+    with stdio(output=SINK):
+        pass
+
+
+def check_like():
+    # the same redirections as `check()` of my.py does for every submission
+    with stdio(input=SMALL):
+        input()
+    with stdio(input=SMALL):
+        input()
+    with stdio(input=SMALL):
+        input()
+
+
+def capture_large():
+    with stdio(output=True) as cm:
+        sys.stdout.write(LARGE)
+    cm.output_get()
+
+
+SINK = StringIO()
+
+CASES = [
+    ('input=str', enter_exit_input, NUMBER),
+    ('output=True', enter_exit_output, NUMBER),
+    ('output=file', enter_exit_file, NUMBER),
+    ('check() x3', check_like, NUMBER),
+    ('capture 600KB', capture_large, NUMBER // 100),
+]
+
+
+def run_cases(mode):
+    for name, func, number in CASES:
+        best = min(Timer(func).repeat(repeat=5, number=number)) / number
+        print(f'{mode:>8} {name:>15}: {best * 1e6:8.3f} usec per call', file=sys.__stdout__)
+
+
+def main():
+    run_cases('global')
+
+    install_context_stdio()
+    try:
+        run_cases('context')
+    finally:
+        uninstall_context_stdio()
+
+
+if __name__ == '__main__':
+    main()
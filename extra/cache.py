@@ -0,0 +1,313 @@
+import logging as log
+import os
+import pickle
+import shutil
+from functools import lru_cache, partial, wraps
+from hashlib import sha256
+from pathlib import Path
+from tempfile import mkdtemp, mkstemp
+
+from extra.sources import local_sources
+from implementation.solver import hinter, input_reader
+from pre_definition.solve_caller import call_with_args
+from pre_definition.stdio import stdio, to_bytes
+from pre_definition.tag import is_binary
+
+CACHE_DIR = Path('.cache')
+DATASETS_DIR = CACHE_DIR / 'datasets'
+# generated datasets depend on these modules and local modules they import,
+# any change of them invalidates cached datasets
+GENERATOR_MODULES = [Path('implementation/generator.py')]
+INPUTS_DIR = CACHE_DIR / 'inputs'
+# parsed inputs depend on these modules and local modules they import
+READER_MODULES = [Path('implementation/solver.py')]
+# loading smaller inputs saves about a millisecond or less, not worth a file each, see `python -m extra.bench_cache`
+MIN_CACHED_INPUT = 64 * 1024
+# parsed inputs used least recently are deleted above this total size of them
+MAX_INPUTS_SIZE = 512 * 1024 * 1024
+
+# switched off by `--no-cache`, see `cache_from_args`
+enabled = True
+
+# suffixes of cached tests by type of generated data
+TEXT = '.txt'
+BINARY = '.bin'
+SPILLED = '.spill'
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f'generate datasets and parse inputs again, the on-disk cache "{CACHE_DIR}" '
+                             f'is neither read nor written')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help=f'delete the on-disk cache "{CACHE_DIR}" first')
+
+
+def cache_from_args(args):
+    """
+    Clear and switch off the on-disk cache as arguments say, worker processes forked afterwards follow it
+    """
+
+    global enabled
+    if args.clear_cache:
+        clear_cache()
+    enabled = not args.no_cache
+
+
+def clear_cache():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    log.info(f'Cache "{CACHE_DIR}" has been cleared')
+
+
+@lru_cache(maxsize=None)
+def sources_fingerprint(modules):
+    """
+    :param modules: tuple of module files, local modules they import are fingerprinted as well
+    """
+
+    h = sha256()
+    for src in local_sources(modules):
+        h.update(f'{src.as_posix()}:'.encode('utf-8'))
+        h.update(sha256(src.read_bytes()).digest())
+    return h.hexdigest()
+
+
+def dataset_key(name):
+    """
+    :return: fingerprint of generator sources, they hold `@params` arguments and seeds, and the dataset name
+    """
+
+    return sha256(f'{sources_fingerprint(tuple(GENERATOR_MODULES))}:{name}'.encode('utf-8')).hexdigest()[:16]
+
+
+class SpilledTest:
+    """
+    Binary file of a cached spilled test, it is opened on the first use, so a dataset may be held in a list
+    without running out of file descriptors. Close it (e.g. by `with`) once it is read.
+    """
+
+    def __init__(self, *paths: Path):
+        """
+        :param paths: the first existing one is opened, e.g. a test being generated is moved into the cache later
+        """
+
+        self.paths = paths
+        self.file = None
+
+    def __getattr__(self, name):
+        # e.g. `read`, `seek` and `mode` of the opened file
+        if name.startswith('__') or name in ('paths', 'file'):
+            raise AttributeError(name)
+        if self.file is None:
+            self.file = self._open()
+        return getattr(self.file, name)
+
+    def _open(self):
+        for path in self.paths[:-1]:
+            try:
+                return path.open('rb')
+            except FileNotFoundError:
+                pass
+        return self.paths[-1].open('rb')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def cached_dataset(name, f):
+    """
+    Dataset reading tests from the on-disk cache, the first call stores tests while `f` yields them.
+    Spilled tests are cached as files and given as `SpilledTest`.
+    """
+
+    @wraps(f)
+    def _cached():
+        if not enabled:
+            return f()
+        cachedir = DATASETS_DIR / f'{name}-{dataset_key(name)}'
+        if cachedir.is_dir():
+            log.debug(f'Dataset "{name}" has been read from cache "{cachedir}"')
+            return read_tests(cachedir)
+        return write_tests(name, cachedir, f())
+
+    _cached.is_cached = True
+    return _cached
+
+
+def read_tests(cachedir: Path):
+    for path in sorted(cachedir.iterdir(), key=lambda p: int(p.stem)):
+        if path.suffix == SPILLED:
+            yield SpilledTest(path)
+        elif path.suffix == BINARY:
+            yield path.read_bytes()
+        else:
+            yield path.read_bytes().decode('utf-8')
+
+
+def write_tests(name, cachedir: Path, tests):
+    # tests are written into a temporary dir, the cache appears only after the dataset is generated completely
+    DATASETS_DIR.mkdir(parents=True, exist_ok=True)
+    tmpdir = Path(mkdtemp(dir=DATASETS_DIR, prefix=f'.{name}-'))
+    complete = False
+    try:
+        for testno, data in enumerate(tests, start=1):
+            if hasattr(data, 'read'):
+                path = tmpdir / f'{testno}{SPILLED}'
+                with data, path.open('wb') as f:
+                    shutil.copyfileobj(data, f)
+                yield SpilledTest(path, cachedir / path.name)
+            elif isinstance(data, bytes):
+                (tmpdir / f'{testno}{BINARY}').write_bytes(data)
+                yield data
+            else:
+                (tmpdir / f'{testno}{TEXT}').write_bytes(data.encode('utf-8'))
+                yield data
+        complete = True
+    finally:
+        if complete:
+            publish_tests(name, tmpdir, cachedir)
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def publish_tests(name, tmpdir: Path, cachedir: Path):
+    for stale in DATASETS_DIR.glob(f'{name}-*'):
+        if stale != cachedir:
+            log.debug(f'Deleting stale cache "{stale}"')
+            shutil.rmtree(stale, ignore_errors=True)
+
+    try:
+        tmpdir.rename(cachedir)
+        log.debug(f'Dataset "{name}" has been cached in "{cachedir}"')
+    except OSError:
+        # the same dataset has been cached concurrently
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def read_input(data):
+    """
+    Parse test input by `input_reader` and get its hint, both are loaded from the on-disk cache if the same input
+    has been parsed before, e.g. by another stage. Loaded objects are never shared, so callers may change them.
+    Inputs shorter than `MIN_CACHED_INPUT` are always parsed.
+    :param data: test input, text, bytes or a file at its start
+    :return: (input data, hint)
+    """
+
+    if not enabled or input_size(data) < MIN_CACHED_INPUT:
+        return parse_input(data)
+
+    inputdir = INPUTS_DIR / sources_fingerprint(tuple(READER_MODULES))[:16]
+    path = inputdir / f'{input_key(data)}.pickle'
+    try:
+        with path.open('rb') as f:
+            parsed = pickle.load(f)
+        touch(path)
+        return parsed
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.debug(f'Failed to load parsed input "{path}": {e}')
+
+    parsed = parse_input(data)
+
+    try:
+        dump_input(parsed, inputdir, path)
+        prune_inputs(inputdir)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        log.debug(f'Parsed input is not cached: {e}')
+    return parsed
+
+
+def input_size(data):
+    """
+    :return: length of text or bytes, size of file
+    """
+
+    if hasattr(data, 'read'):
+        size = data.seek(0, os.SEEK_END)
+        data.seek(0)
+        return size
+    return len(data)
+
+
+def parse_input(data):
+    with stdio(input=data, binary=is_binary(input_reader)):
+        input_data = input_reader()
+    return input_data, call_with_args(hinter, input_data)
+
+
+def input_key(data):
+    h = sha256()
+    if hasattr(data, 'read'):
+        # text files are hashed by their encoded blocks, the same as text given directly
+        for block in iter(partial(data.read, BLOCK_SIZE), data.read(0)):
+            h.update(to_bytes(block))
+        data.seek(0)
+    else:
+        h.update(to_bytes(data))
+    return h.hexdigest()
+
+
+def touch(path: Path):
+    # modification time of a parsed input is the time it was used last, see `prune_inputs`
+    try:
+        os.utime(path)
+    except OSError:
+        # pruned concurrently
+        pass
+
+
+def prune_inputs(inputdir: Path, max_size=None):
+    """
+    Delete parsed inputs used least recently, until the total size of them fits into `max_size`
+    :param max_size: bytes, `MAX_INPUTS_SIZE` by default
+    """
+
+    max_size = MAX_INPUTS_SIZE if max_size is None else max_size
+    used = []
+    for path in inputdir.glob('*.pickle'):
+        if path.name.startswith('.'):
+            # being dumped
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        used.append((st.st_mtime, path.name, st.st_size, path))
+
+    total = sum(size for _, _, size, _ in used)
+    for _, _, size, path in sorted(used):
+        if total <= max_size:
+            break
+        log.debug(f'Deleting parsed input "{path}" used least recently')
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def dump_input(parsed, inputdir: Path, path: Path):
+    if not inputdir.is_dir():
+        # parsed inputs of changed sources are never read again
+        for stale in INPUTS_DIR.glob('*'):
+            if stale != inputdir:
+                shutil.rmtree(stale, ignore_errors=True)
+        inputdir.mkdir(parents=True, exist_ok=True)
+
+    # dumped beside and renamed, so concurrent readers never load a partial file
+    fd, tmpname = mkstemp(dir=inputdir, prefix='.', suffix='.pickle')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
@@ -1,5 +1,9 @@
 import logging as log
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pre_definition.stdio import install_context_stdio
 
 
 def clear_dir(dsdir):
@@ -17,3 +21,41 @@ def clear_dir(dsdir):
             quit(-1)
 
     log.info(f'Directory "{dsdir}" has been cleared')
+
+
+def link_file(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        log.debug(f'Failed to hardlink "{src}", copying instead')
+        shutil.copyfile(src, dst)
+
+
+def remove_stale(dsdir, keep):
+    """
+    Delete files under `dsdir` which are not listed in `keep` and dirs left empty.
+    :param keep: collection of posix paths relative to `dsdir`
+    """
+
+    for item in sorted(dsdir.rglob('*'), reverse=True):
+        if item.is_dir():
+            if not any(item.iterdir()):
+                log.debug(f'Deleting empty dir "{item}"')
+                item.rmdir()
+        elif item.relative_to(dsdir).as_posix() not in keep:
+            log.debug(f'Deleting stale "{item}"')
+            item.unlink()
+
+
+def create_executor(jobs, threads=False):
+    """
+    Pool of worker processes, or of threads sharing this process with context-local stdio
+    """
+
+    if threads:
+        install_context_stdio()
+        log.info(f'Running with {jobs} worker threads')
+        return ThreadPoolExecutor(jobs)
+
+    log.info(f'Running with {jobs} worker processes')
+    return ProcessPoolExecutor(jobs)
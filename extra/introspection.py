@@ -1,18 +1,23 @@
 import logging as log
 from typing import Callable as ABCCallable
 
+from extra.cache import cached_dataset
 from implementation import generator as generators
 from implementation import wrong as wrongs
 
 
-def collect_datasets():
+def collect_datasets(cache=True):
+    """
+    :param cache: read generated tests from the on-disk cache, see `extra.cache`
+    """
+
     datasets = []
     for name, obj in generators.__dict__.items():
         if not isinstance(obj, ABCCallable):
             continue
         if hasattr(obj, 'is_dataset'):
             log.debug(f'Dataset "{name}" has been collected')
-            datasets.append((name, obj))
+            datasets.append((name, find_dataset(name, cache)))
 
     log.info(f'Total datasets groups: {len(datasets)}')
     assert len(datasets) > 0, 'No datasets'
@@ -20,6 +25,31 @@ def collect_datasets():
     return datasets
 
 
+def find_dataset(name, cache=True):
+    f = getattr(generators, name)
+    if cache and not getattr(f, 'is_cached', False):
+        return cached_dataset(name, f)
+    return f
+
+
+def warm_datasets(datasets):
+    """
+    Generate every dataset into the on-disk cache, so processes run afterwards only read tests from there
+    :param datasets: cached datasets, as `collect_datasets` gives them
+    :return: number of tests
+    """
+
+    total = 0
+    for name, f in datasets:
+        for data in f():
+            if hasattr(data, 'close'):
+                data.close()
+            total += 1
+        log.debug(f'Dataset "{name}" has been cached')
+
+    return total
+
+
 def collect_wrong_solutions():
     wrsols = []
     for name, obj in wrongs.__dict__.items():
@@ -0,0 +1,208 @@
+import logging as log
+import multiprocessing
+import resource
+import signal
+import traceback
+from math import ceil
+from time import perf_counter
+
+from pre_definition.solve_caller import call_with_args
+from pre_definition.stdio import stdio, to_text
+from pre_definition.tag import is_binary
+
+OK = 'OK'
+TLE = 'TLE'
+MLE = 'MLE'
+RE = 'RE'
+
+MB = 1024 * 1024
+
+
+class Limits:
+    """
+    Per test limits, None means unbounded
+    :param wall: wall-clock seconds
+    :param cpu: cpu seconds
+    :param memory: address space bytes allocated by the call, on top of what the process has at its start
+    """
+
+    def __init__(self, wall=None, cpu=None, memory=None):
+        self.wall = wall
+        self.cpu = cpu
+        self.memory = memory
+
+    def __bool__(self):
+        return any(x is not None for x in (self.wall, self.cpu, self.memory))
+
+    def timeout(self):
+        """
+        :return: the tightest of wall-clock and cpu limits, None if both are unbounded
+        """
+
+        bounds = [x for x in (self.wall, self.cpu) if x is not None]
+        return min(bounds) if bounds else None
+
+    def __str__(self):
+        parts = []
+        if self.wall is not None:
+            parts.append(f'wall {self.wall}s')
+        if self.cpu is not None:
+            parts.append(f'cpu {self.cpu}s')
+        if self.memory is not None:
+            parts.append(f'memory {self.memory / MB:.0f}MB')
+        return ', '.join(parts) or 'unbounded'
+
+
+NO_LIMITS = Limits()
+
+
+class Run:
+    def __init__(self, verdict, output=None, time=None, memory=None, error=''):
+        self.verdict = verdict
+        self.output = output
+        self.time = time
+        self.memory = memory
+        self.error = error
+
+    def __str__(self):
+        return f'{self.verdict}: {self.error}' if self.error else self.verdict
+
+
+class LimitException(Exception):
+    def __init__(self, run: Run):
+        super().__init__(str(run))
+        self.run = run
+
+
+class Peak:
+    """
+    Tracks the slowest and the most memory hungry test
+    """
+
+    def __init__(self):
+        self.time = 0.0
+        self.time_name = None
+        self.memory = 0
+        self.memory_name = None
+
+    def update(self, full_name, run: Run):
+        if run.time is not None and run.time >= self.time:
+            self.time, self.time_name = run.time, full_name
+        if run.memory is not None and run.memory >= self.memory:
+            self.memory, self.memory_name = run.memory, full_name
+
+    def report(self, who):
+        if self.time_name is not None:
+            log.info(f'{who} peak time: {self.time:.3f}s at {self.time_name}')
+        if self.memory_name is not None:
+            log.info(f'{who} peak memory: {self.memory / MB:.1f}MB at {self.memory_name}')
+
+
+def add_limits_arguments(parser):
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='wall-clock seconds per test (default: unbounded)')
+    parser.add_argument('--cpu-limit', type=float, default=None,
+                        help='cpu seconds per test (default: unbounded)')
+    parser.add_argument('--memory-limit', type=int, default=None,
+                        help='address space megabytes per test (default: unbounded)')
+
+
+def limits_from_args(args):
+    memory = None if args.memory_limit is None else args.memory_limit * MB
+    return Limits(wall=args.time_limit, cpu=args.cpu_limit, memory=memory)
+
+
+def call_limited(func, args, limits=NO_LIMITS, output=None) -> Run:
+    """
+    Call `func` with `args` capturing its stdout, in bytes mode if `func` is marked as `@binary`.
+    With any limit set the call runs in a forked process with rlimits and failures become verdicts,
+    otherwise it runs in place and exceptions propagate as usual.
+    The forked process shares memory of this one, so memory is limited and measured relative to its start.
+    :param output: file path to write stdout into, `Run.output` is None then
+    :return: Run with verdict, captured output, elapsed seconds and peak memory bytes allocated by the call
+        (if measured)
+    """
+
+    if not limits:
+        return _call(func, args, output)
+
+    ctx = multiprocessing.get_context('fork')
+    receiver, sender = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(sender, func, args, limits, output), daemon=True)
+
+    start = perf_counter()
+    proc.start()
+    sender.close()
+
+    try:
+        if receiver.poll(limits.wall):
+            verdict, out, elapsed, memory, error = receiver.recv()
+            return Run(verdict, out, elapsed, memory, error)
+    except EOFError:
+        # child died before sending its result
+        pass
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        receiver.close()
+
+    elapsed = perf_counter() - start
+    if limits.wall is not None and elapsed >= limits.wall:
+        return Run(TLE, time=elapsed, error=f'killed after {limits.wall}s of wall-clock time')
+    if proc.exitcode in (-signal.SIGXCPU, -signal.SIGKILL) and limits.cpu is not None:
+        return Run(TLE, time=elapsed, error=f'killed after {limits.cpu}s of cpu time')
+    return Run(RE, time=elapsed, error=f'process died with exit code {proc.exitcode}')
+
+
+def _call(func, args, output=None):
+    binary = is_binary(func)
+    start = perf_counter()
+    if output is None:
+        with stdio(output=True, binary=binary) as cm:
+            call_with_args(func, args)
+        out = to_text(cm.output_get())
+    else:
+        with open(output, 'wb' if binary else 'w') as f, stdio(output=f, binary=binary):
+            call_with_args(func, args)
+        out = None
+
+    return Run(OK, out, perf_counter() - start)
+
+
+def address_space():
+    """
+    :return: virtual memory bytes of this process, 0 if unknown (no procfs)
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _child(sender, func, args, limits, output):
+    # a forked child starts with the resident set and the address space of the parent
+    # ru_maxrss is in kilobytes on Linux, it starts from the current resident set after fork
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if limits.cpu is not None:
+        soft = ceil(limits.cpu)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+    if limits.memory is not None:
+        memory = address_space() + limits.memory
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    start = perf_counter()
+    try:
+        run = _call(func, args, output)
+    except MemoryError:
+        run = Run(MLE, time=perf_counter() - start, error='MemoryError')
+    except Exception as e:
+        run = Run(RE, time=perf_counter() - start, error=''.join(traceback.format_exception_only(e)).strip())
+
+    run.memory = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) * 1024
+
+    sender.send((run.verdict, run.output, run.time, run.memory, run.error))
+    sender.close()
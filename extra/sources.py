@@ -0,0 +1,87 @@
+import ast
+import sysconfig
+from functools import lru_cache
+from importlib.machinery import PathFinder
+from pathlib import Path
+
+
+@lru_cache(maxsize=None)
+def find_module_spec(name):
+    """
+    Spec of module found without importing it or its parent packages, so nothing is executed
+    :return: ModuleSpec or None for modules not found on the path, e.g. builtin ones
+    """
+
+    parent, _, _ = name.rpartition('.')
+    path = None
+    if parent:
+        parent_spec = find_module_spec(parent)
+        if parent_spec is None or parent_spec.submodule_search_locations is None:
+            return None
+        path = list(parent_spec.submodule_search_locations)
+
+    return PathFinder.find_spec(name, path)
+
+
+def find_file(name):
+    spec = find_module_spec(name)
+    if spec is None or not spec.has_location or spec.origin is None:
+        return None
+    return Path(spec.origin)
+
+
+def imported_modules(modpath: Path):
+    """
+    Names of modules imported anywhere in module file, found on its AST, so nothing is executed.
+    Parent packages are listed as well, `from a import b` lists `a.b` too, since `b` may be a submodule.
+    Relative imports are skipped.
+    """
+
+    names = []
+    for node in ast.walk(ast.parse(modpath.read_text())):
+        if isinstance(node, ast.Import):
+            names.extend(nm.name for nm in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            names.append(node.module)
+            names.extend(f'{node.module}.{nm.name}' for nm in node.names if nm.name != '*')
+
+    for name in names:
+        parts = name.split('.')
+        for i in range(1, len(parts) + 1):
+            yield '.'.join(parts[:i])
+
+
+@lru_cache(maxsize=None)
+def installed_dirs():
+    paths = sysconfig.get_paths()
+    return [Path(paths[key]).resolve() for key in ('stdlib', 'platstdlib', 'purelib', 'platlib')]
+
+
+def is_local_file(path: Path, root: Path):
+    # e.g. `venv/` inside the project dir holds installed packages
+    path = path.resolve()
+    return path.is_relative_to(root.resolve()) and not any(path.is_relative_to(d) for d in installed_dirs())
+
+
+def local_sources(modpaths, root=Path('.')):
+    """
+    Module files and the local modules they import, transitively
+    :param modpaths: module files
+    :param root: project dir, modules outside of it or installed into the interpreter are not local
+    :return: sorted list of paths relative to `root`
+    """
+
+    root = root.resolve()
+    found = set()
+    queue = [Path(p).resolve() for p in modpaths]
+    while queue:
+        path = queue.pop()
+        if path in found:
+            continue
+        found.add(path)
+        for name in imported_modules(path):
+            f = find_file(name)
+            if f is not None and f.suffix == '.py' and is_local_file(f, root):
+                queue.append(f.resolve())
+
+    return sorted(p.relative_to(root) if p.is_relative_to(root) else p for p in found)
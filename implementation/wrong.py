@@ -1,3 +1,5 @@
+from itertools import product
+
 from pre_definition.tag import wrong
 
 
@@ -9,3 +11,14 @@ def plus1(n):
 @wrong
 def noway(n):
     print(n)
+
+
+@wrong(slow=True)
+def solver_slow(n):
+    template = [(0, 1)] * n
+    k = 0
+    for s in product(*template):
+        s = list(s)
+        if (s[0], s[-1]) != (0, 0) and (0, 0) not in zip(s[1:], s[:-1]):
+            k += 1
+    print(k)
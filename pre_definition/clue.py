@@ -0,0 +1,103 @@
+import base64
+import json
+import lzma
+import zlib
+from hashlib import sha256
+
+# clue formats, `DIGEST` keeps only a digest of expected output and fits exact-match checkers only
+PLAIN = 'plain'
+ZLIB = 'zlib'
+LZMA = 'lzma'
+DIGEST = 'digest'
+
+PACKINGS = [PLAIN, ZLIB, LZMA, DIGEST]
+
+# the first char of a packed field tells if the rest is compressed
+RAW_FIELD = '.'
+COMPRESSED_FIELD = '#'
+
+
+def compress_text(s, packing=ZLIB):
+    data = s.encode('utf-8')
+    data = lzma.compress(data) if packing == LZMA else zlib.compress(data, 9)
+    return base64.b64encode(data).decode('ascii')
+
+
+def decompress_text(s, packing=ZLIB):
+    data = base64.b64decode(s)
+    data = lzma.decompress(data) if packing == LZMA else zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+def digest_of(data):
+    """
+    :param data: parsed output, its `repr` is hashed, so it should be made of builtin types
+    """
+
+    return sha256(repr(data).encode('utf-8')).hexdigest()
+
+
+def encoded_len(obj):
+    # clues are sent as json
+    return len(json.dumps(obj))
+
+
+def pack_field(s, packing):
+    compressed = compress_text(s, packing)
+    if encoded_len(compressed) < encoded_len(s):
+        return COMPRESSED_FIELD + compressed
+    return RAW_FIELD + s
+
+
+def unpack_field(field, packing):
+    if field[:1] == COMPRESSED_FIELD:
+        return decompress_text(field[1:], packing)
+    return field[1:]
+
+
+def pack_clue(instr, expected, packing=ZLIB):
+    """
+    Texts are compressed only if it makes them shorter, clue which gets no shorter stays `PLAIN`
+    :param expected: expected output, or its digest for `DIGEST` packing
+    :return: `(instr, expected)` for `PLAIN` packing, otherwise `(packing, packed instr, expected)`
+        with expected packed as well unless it is a digest
+    """
+
+    if packing == PLAIN:
+        return instr, expected
+    if packing == DIGEST:
+        return packing, pack_field(instr, ZLIB), expected
+
+    assert packing in PACKINGS, f'Unknown clue packing "{packing}"!'
+    packed = packing, pack_field(instr, packing), pack_field(expected, packing)
+    if encoded_len(packed) < encoded_len((instr, expected)):
+        return packed
+    return instr, expected
+
+
+def unpack_clue(clue):
+    """
+    :return: (packing, instr, expected output or its digest)
+    """
+
+    if len(clue) == 2:
+        instr, expected = clue
+        return PLAIN, instr, expected
+
+    packing, instr, expected = clue
+    if packing == DIGEST:
+        return packing, unpack_field(instr, ZLIB), expected
+    return packing, unpack_field(instr, packing), unpack_field(expected, packing)
+
+
+def bake_tests(tests):
+    """
+    :param tests: list of (input, expected output)
+    :return: compressed text blob to embed into my.py
+    """
+
+    return compress_text(json.dumps(tests, separators=(',', ':')), LZMA)
+
+
+def unbake_tests(blob):
+    return [tuple(test) for test in json.loads(decompress_text(blob, LZMA))]
@@ -1,14 +1,64 @@
+import sys
 from collections.abc import Iterable as ABCIterable, Mapping as ABCMapping
-from itertools import product
+from functools import partial
 from random import Random
+from tempfile import SpooledTemporaryFile
 from typing import List, Tuple, Iterable
 
 from pre_definition.stdio import stdio
 from pre_definition.tag import dataset
 
 
-def ds2str(ds):
-    return '\n'.join(' '.join(map(str, x)) for x in ds) + '\n'
+# rows written at once by `ds2str` into a file
+DS2STR_CHUNK = 1024
+
+
+def ds2str(ds, file=None):
+    """
+    Serialize rows into lines of space separated values, a row is formatted at once by a cached format string
+    :param ds: rows, e.g. nested lists, list of `array.array` or 2d numpy array
+    :param file: text file-like object to write into by chunks of rows
+    :return: str, None if `file` is given
+    """
+
+    formats = dict()
+    lines = []
+    written = False
+    for row in plain_rows(ds):
+        row = plain_row(row)
+        fmt = formats.get(len(row))
+        if fmt is None:
+            fmt = formats[len(row)] = ' '.join(['%s'] * len(row))
+        lines.append(fmt % row)
+
+        if file is not None and len(lines) == DS2STR_CHUNK:
+            file.write('\n'.join(lines) + '\n')
+            lines.clear()
+            written = True
+
+    if file is not None:
+        if lines or not written:
+            file.write('\n'.join(lines) + '\n')
+        return None
+
+    if not lines:
+        return '\n'
+    # trailing newline without copying the whole text once more
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def is_numpy_integral(obj):
+    # numpy scalars are slow to format, integers and bools are formatted the same as python ones
+    return getattr(getattr(obj, 'dtype', None), 'kind', None) in ('i', 'u', 'b')
+
+
+def plain_rows(ds):
+    return ds.tolist() if is_numpy_integral(ds) else ds
+
+
+def plain_row(row):
+    return tuple(row.tolist() if is_numpy_integral(row) else row)
 
 
 class Sentinel:
@@ -65,14 +115,28 @@ def is_collection(obj):
     return isinstance(obj, ABCIterable) and not isinstance(obj, str)
 
 
-def parse_params(params):
+def is_virtual_axis(obj):
+    # sized and indexable, e.g. range, tuple or numpy array, so there is no need to copy it
+    return not isinstance(obj, ABCMapping) and hasattr(obj, '__len__') and hasattr(obj, '__getitem__')
+
+
+def axis_len(values):
+    if isinstance(values, range):
+        # len() fails for ranges longer than sys.maxsize
+        return max(0, (values.stop - values.start + values.step - (1 if values.step > 0 else -1)) // values.step)
+    return len(values)
+
+
+def parse_params(params, stream=False):
     """
-    Extract list of names + collapse iterators into lists
+    Extract list of names + collapse unsized iterators into lists
     :param params: list of tuples (str, iter)
-    :return: list of tuples (list[str], list)
+    :param stream: keep unsized iterators as they are
+    :return: list of tuples (list[str], sequence or iterable)
     """
 
-    return [(parse_comma_sep_ids(names), list(values)) for names, values in params]
+    return [(parse_comma_sep_ids(names), values if stream or is_virtual_axis(values) else list(values))
+            for names, values in params]
 
 
 def is_tuple_len_(n):
@@ -121,13 +185,157 @@ def any2tuple(names):
 
 def eliminate_dicts(obj):
     names, ls = obj
-    if len(names) == 1:
+    if len(names) == 1 or all(isinstance(values, tuple) for values in ls):
         return obj
     else:
         return names, lmap(any2tuple(names), ls)
 
 
-def convert_params(params):
+class ParamsProduct:
+    """
+    Virtual cartesian product of params, it is never materialized.
+    Iteration order is the same as `itertools.product`, item at index is decoded as a mixed-radix number.
+    """
+
+    def __init__(self, params):
+        """
+        :param params: list of tuples (list[str], sequence)
+        """
+
+        self.params = params
+        self.sizes = [axis_len(values) for _, values in params]
+        self.size = 1
+        for size in self.sizes:
+            self.size *= size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return collapse_dicts_collection_into_params(self._iter_dicts(0))
+
+    def _iter_dicts(self, k):
+        # unlike `itertools.product` it never copies axes, the inner ones are just iterated again
+        if k == len(self.params):
+            yield []
+            return
+
+        names, values = self.params[k]
+        for d in dict_gen(names, values):
+            for rest in self._iter_dicts(k + 1):
+                yield [d] + rest
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError('ParamsProduct index out of range')
+
+        r = dict()
+        # the last param changes the fastest
+        for (names, values), size in zip(reversed(self.params), reversed(self.sizes)):
+            index, i = divmod(index, size)
+            if len(names) == 1:
+                r[names[0]] = values[i]
+            else:
+                r.update(zip(names, values[i]))
+        return r
+
+
+def size_of(params):
+    # len() fails for sizes above sys.maxsize
+    return params.size if isinstance(params, ParamsProduct) else len(params)
+
+
+def sample_indexes(rnd, size, k):
+    """
+    Pick `k` distinct random indexes out of `range(size)` in O(k) memory
+    """
+
+    if size <= sys.maxsize:
+        return rnd.sample(range(size), k)
+
+    # `k` fits in memory, so it is negligible against such a huge `size`
+    picked = set()
+    indexes = []
+    while len(indexes) < k:
+        i = rnd.randrange(size)
+        if i not in picked:
+            picked.add(i)
+            indexes.append(i)
+    return indexes
+
+
+class StreamedAxis:
+    """
+    Unsized param values, checked and converted into tuples on the fly.
+    One-shot iterators are buffered as they are consumed, so every pass gets the same values.
+    """
+
+    def __init__(self, index, names, values):
+        self.index = index
+        self.names = names
+        self.values = values
+        self.buffer = [] if iter(values) is values else None
+
+    def __iter__(self):
+        to_tuple = any2tuple(self.names)
+        for values in self._iter_values():
+            if len(self.names) == 1:
+                yield values
+                continue
+            if not is_corresponding_names_to_lists((self.names, [values])):
+                assert False, names_mismatch_msg(self.index, len(self.names))
+            yield to_tuple(values)
+
+    def _iter_values(self):
+        if self.buffer is None:
+            yield from self.values
+            return
+
+        # passes may interleave, each one continues the shared iterator where the buffer ends
+        i = 0
+        while True:
+            if i == len(self.buffer):
+                try:
+                    self.buffer.append(next(self.values))
+                except StopIteration:
+                    return
+            yield self.buffer[i]
+            i += 1
+
+
+class ParamsStream:
+    """
+    Cartesian product of params with unsized ones, the first param is streamed without buffering,
+    the other unsized ones are collapsed into lists at the beginning of every pass.
+    Iteration order is the same as `itertools.product`.
+    """
+
+    def __init__(self, params):
+        """
+        :param params: list of tuples (list[str], sequence or StreamedAxis)
+        """
+
+        self.params = params
+
+    def __iter__(self):
+        names, values = self.params[0]
+        inner = ParamsProduct([(nms, vls if is_virtual_axis(vls) else list(vls)) for nms, vls in self.params[1:]])
+        for d in dict_gen(names, values):
+            for rest in inner:
+                yield merge_dicts([d, rest])
+
+
+def names_mismatch_msg(index, plen):
+    return (f'Second part of tuple in `params[{index}]` should be a collection of tuples size {plen} '
+            f'or dict with exact keys!')
+
+
+def convert_params(params, stream=False):
+    """
+    :param stream: keep unsized iterables lazy, result is ParamsStream then (if there are any)
+    :return: ParamsProduct or ParamsStream
+    """
+
     check = lmap(is_tuple_len_2, params)
     if not all(check):
         index = check.index(False)
@@ -149,17 +357,17 @@ def convert_params(params):
         assert False, msg
 
     # parsing names and collapsing iterables
-    params = parse_params(params)
+    params = parse_params(params, stream)
+    streamed = [not is_virtual_axis(values) for _, values in params]
 
-    check = lmap(is_corresponding_names_to_lists, params)
+    # streamed ones are checked on the fly
+    check = [s or is_corresponding_names_to_lists(x) for s, x in zip(streamed, params)]
     if not all(check):
         index = check.index(False)
-        plen = len(params[index][0])
-        msg = (f'Second part of tuple in `params[{index}]` should be a collection of tuples size {plen} '
-               f'or dict with exact keys!')
-        assert False, msg
+        assert False, names_mismatch_msg(index, len(params[index][0]))
 
-    params = lmap(eliminate_dicts, params)
+    params = [(names, StreamedAxis(i, names, values)) if streamed[i] else eliminate_dicts((names, values))
+              for i, (names, values) in enumerate(params)]
 
     names = sorted([(name, i) for i, x in enumerate(params) for name in x[0]])
     unique_names = sorted(list(set([name for name, _ in names])))
@@ -171,55 +379,115 @@ def convert_params(params):
                 break
         assert False, msg
 
-    # convert names and lists into dict generators
-    dictgens = [dict_gen(names, values) for names, values in params]
-    return collapse_dicts_collection_into_params(product(*dictgens))
+    if any(streamed):
+        return ParamsStream(params)
+    return ParamsProduct(params)
 
 
-def call_printer(f, ps=SENTINEL):
+def call_printer(f, ps=SENTINEL, binary=False, spill=None):
+    """
+    :param binary: run `f` in bytes mode, it may write to `sys.stdout.buffer`, and return bytes
+    :param spill: capture in bytes mode into a spooled temporary file, output longer than `spill` bytes
+        is returned as the file rewound to its start instead of bytes
+    """
+
     if ps is SENTINEL:
         ps = {}
 
-    with stdio(output=True) as std:
+    if spill is not None:
+        return call_spilling_printer(f, ps, spill)
+
+    with stdio(output=True, binary=binary) as std:
         f(**ps)
 
     return std.output_get()
 
 
-def gen_all(params, **kwargs):
+def call_spilling_printer(f, ps, spill):
+    spool = SpooledTemporaryFile(max_size=spill, mode='w+b')
+    try:
+        with stdio(output=spool, binary=True):
+            f(**ps)
+    except BaseException:
+        spool.close()
+        raise
+
+    # the spool moves its data to disk once the written size exceeds `max_size`
+    size = spool.tell()
+    spool.seek(0)
+    if size > spill:
+        return spool
+    with spool:
+        return spool.read()
+
+
+def gen_all(params, printer=call_printer, **kwargs):
     def _decor(f):
         def _new_func():
             for p in params:
-                yield call_printer(f, p)
+                yield printer(f, p)
 
         return _new_func
 
     return _decor
 
 
-def gen_n(params, n, seed, **kwargs):
-    shuffled_params = list(params)
-    Random(seed).shuffle(shuffled_params)
+def gen_n(params, n, seed, printer=call_printer, **kwargs):
+    size = size_of(params)
+    indexes = sample_indexes(Random(seed), size, min(n, size))
 
     def _decor(f):
         def _new_func():
-            for i, p in enumerate(shuffled_params):
-                if i == n:
-                    return
-                yield call_printer(f, p)
+            for i in indexes:
+                yield printer(f, params[i])
 
         return _new_func
 
     return _decor
 
 
-def gen_sample(params, sample, seed, **kwargs):
-    listed_params = list(params)
-    n = max(1, int(len(listed_params) * sample))
-    return gen_n(listed_params, n, seed)
+def gen_sample(params, sample, seed, printer=call_printer, **kwargs):
+    if isinstance(params, ParamsStream):
+        return gen_bernoulli(params, sample, seed, printer)
 
+    n = max(1, int(size_of(params) * sample))
+    return gen_n(params, n, seed, printer)
+
+
+def gen_bernoulli(params, sample, seed, printer=call_printer, **kwargs):
+    """
+    Single pass sampling: every combination is taken with `sample` probability,
+    the last one is taken if nothing else was
+    """
+
+    def _decor(f):
+        def _new_func():
+            rnd = Random(seed)
+            last = SENTINEL
+            taken = False
+            for p in params:
+                last = p
+                if rnd.random() < sample:
+                    taken = True
+                    yield printer(f, p)
+            if not taken and last is not SENTINEL:
+                yield printer(f, last)
+
+        return _new_func
+
+    return _decor
+
+
+def params(params: List[Tuple[str, Iterable]], n=SENTINEL, sample=SENTINEL, seed=42, binary=False, spill=None,
+           stream=False):
+    """
+    Dataset of generator outputs over the product of params
+    :param stream: with `sample`, unsized iterables are not collapsed into lists, every combination is taken
+        with `sample` probability in a single pass, so the number of tests is random
+    :param binary: generator runs in bytes mode and tests are bytes
+    :param spill: tests are bytes, and those longer than `spill` bytes are spooled temporary files
+    """
 
-def params(params: List[Tuple[str, Iterable]], n=SENTINEL, sample=SENTINEL, seed=42):
     n_category = None
     if n is SENTINEL:
         n_category = 'SENTINEL'
@@ -254,13 +522,26 @@ def params(params: List[Tuple[str, Iterable]], n=SENTINEL, sample=SENTINEL, seed
     msg = f'Not allowed combination of n={n}({n_category}) and sample={sample}({sample_category})!'
     assert (n_category, sample_category) in allowed_categories, msg
 
-    converted = convert_params(params)
+    msg = f'Streaming works only with `sample`, but sample={sample}({sample_category})!'
+    assert not stream or sample_category == 'proportion', msg
+
+    converted = convert_params(params, stream=stream)
 
     fproto = allowed_categories[(n_category, sample_category)](
         params=converted,
         n=n,
         sample=sample,
         seed=seed,
+        printer=partial(call_printer, binary=binary, spill=spill),
     )
 
-    return lambda f: dataset(fproto(f))
+    declared = params
+
+    def _decor(f):
+        new_f = dataset(fproto(f))
+        # keep origins for introspection (e.g. benchmarks)
+        new_f.generator = f
+        new_f.params = declared
+        return new_f
+
+    return _decor
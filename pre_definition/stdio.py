@@ -1,58 +1,278 @@
+import os
 import sys
-from contextlib import contextmanager
-from io import StringIO, SEEK_END
+from contextvars import ContextVar
+from io import BufferedIOBase, BytesIO, RawIOBase, StringIO, TextIOWrapper, SEEK_END
 from typing import ContextManager
 
+# (stdin, stdout, stderr) of the current thread or task, None means the streams captured at installation
+context_streams = ContextVar('context_streams', default=None)
+# set while context-local proxies are installed, it is checked on every redirection
+context_installed = False
+# set once `uninstall_context_stdio` runs in forked children
+fork_handler_registered = False
+
+
+class ContextStream:
+    """
+    Proxy installed instead of a standard stream, it forwards to the context-local stream
+    """
+
+    __slots__ = ('index', 'default')
+
+    def __init__(self, index, default):
+        self.index = index
+        self.default = default
+
+    def target(self):
+        streams = context_streams.get()
+        return self.default if streams is None else streams[self.index]
+
+    def write(self, s):
+        return self.target().write(s)
+
+    def readline(self, *args):
+        return self.target().readline(*args)
+
+    def __iter__(self):
+        return iter(self.target())
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+def is_context_stdio():
+    return context_installed
+
+
+def install_context_stdio():
+    """
+    Replace standard streams with context-local proxies, so `stdio` redirects only the current thread or task.
+    Safe to call more than once, streams replaced since the previous call get proxies again.
+    """
+
+    global context_installed, fork_handler_registered
+    if not fork_handler_registered and hasattr(os, 'register_at_fork'):
+        # a forked worker runs a single thread and replaces its stdin, so it redirects by swapping `sys` streams
+        os.register_at_fork(after_in_child=uninstall_context_stdio)
+        fork_handler_registered = True
+
+    if context_installed and all(isinstance(s, ContextStream) for s in (sys.stdin, sys.stdout, sys.stderr)):
+        return
+
+    uninstall_context_stdio()
+    sys.stdin = ContextStream(0, sys.stdin)
+    sys.stdout = ContextStream(1, sys.stdout)
+    sys.stderr = ContextStream(2, sys.stderr)
+    context_installed = True
+
+
+def uninstall_context_stdio():
+    global context_installed
+    context_installed = False
+    if isinstance(sys.stdin, ContextStream):
+        sys.stdin = sys.stdin.default
+    if isinstance(sys.stdout, ContextStream):
+        sys.stdout = sys.stdout.default
+    if isinstance(sys.stderr, ContextStream):
+        sys.stderr = sys.stderr.default
+
 
 class Std:
+    """
+    Redirection of standard streams, it is also the handle returned by `stdio`.
+    Captured values are still available after exit.
+    No closures are created per call, all state lives in slots.
+    After `install_context_stdio` streams are switched in the current context instead of `sys`.
+    In binary mode streams are utf-8 text wrappers over bytes buffers, so `sys.stdin.buffer`
+    and `sys.stdout.buffer` are available and captured values are bytes.
+    """
+
+    __slots__ = ('_input', '_output', '_error', '_binary', '_saved', '_token', '_wrapped', '_sin', '_sout', '_serr')
+
+    def __init__(self, input=None, output=None, error=None, binary=False):
+        self._input = input
+        self._output = output
+        self._error = error
+        self._binary = binary
+        self._sin = None
+        self._sout = None
+        self._serr = None
+        self._token = None
+        self._wrapped = None
+
+    def __enter__(self):
+        if context_installed:
+            streams = context_streams.get()
+            if streams is None:
+                streams = sys.stdin.default, sys.stdout.default, sys.stderr.default
+            self._token = context_streams.set(self._redirect(*streams))
+        else:
+            self._saved = sys.stdin, sys.stdout, sys.stderr
+            sys.stdin, sys.stdout, sys.stderr = self._redirect(*self._saved)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._token is not None:
+            context_streams.reset(self._token)
+            self._token = None
+        else:
+            sys.stdin, sys.stdout, sys.stderr = self._saved
+
+        if self._wrapped is not None:
+            # flush and release buffers, otherwise a collected wrapper closes them
+            for wrapper in self._wrapped:
+                wrapper.detach()
+            self._wrapped = None
+        return False
+
+    def _redirect(self, stdin, stdout, stderr):
+        if self._binary:
+            return self._redirect_binary(stdin, stdout, stderr)
+
+        input = self._input
+        if input is not None:
+            if input is True:
+                self._sin = stdin = StringIO()
+            elif isinstance(input, str):
+                self._sin = stdin = StringIO(input)
+            elif isinstance(input, bytes):
+                self._sin = stdin = StringIO(input.decode('utf-8'))
+            elif not isinstance(input, bool):
+                stdin = self._wrap(input) if is_binary_stream(input) else input
+
+        output = self._output
+        if output is not None:
+            if output is True:
+                self._sout = stdout = StringIO()
+            elif not isinstance(output, bool):
+                stdout = output
+
+        error = self._error
+        if error is not None:
+            if error is True:
+                self._serr = stderr = StringIO()
+            elif not isinstance(error, bool):
+                stderr = error
+
+        return stdin, stdout, stderr
+
+    def _redirect_binary(self, stdin, stdout, stderr):
+        input = self._input
+        if input is not None:
+            if input is True:
+                self._sin = BytesIO()
+                stdin = self._wrap(self._sin)
+            elif isinstance(input, (str, bytes)):
+                self._sin = BytesIO(input.encode('utf-8') if isinstance(input, str) else input)
+                stdin = self._wrap(self._sin)
+            elif not isinstance(input, bool):
+                stdin = self._wrap(input) if is_binary_stream(input) else input
+
+        output = self._output
+        if output is not None:
+            if output is True:
+                self._sout = BytesIO()
+                stdout = self._wrap(self._sout)
+            elif not isinstance(output, bool):
+                stdout = self._wrap(output) if is_binary_stream(output) else output
+
+        error = self._error
+        if error is not None:
+            if error is True:
+                self._serr = BytesIO()
+                stderr = self._wrap(self._serr)
+            elif not isinstance(error, bool):
+                stderr = self._wrap(error) if is_binary_stream(error) else error
+
+        return stdin, stdout, stderr
+
+    def _wrap(self, buffer):
+        # same newlines as `StringIO`, text written is passed to the buffer at once
+        wrapper = TextIOWrapper(buffer, encoding='utf-8', newline='\n', write_through=True)
+        if self._wrapped is None:
+            self._wrapped = []
+        self._wrapped.append(wrapper)
+        return wrapper
+
     def input_write(self, s: str):
-        ...
+        if self._sin is None:
+            return NotImplemented
+        special_write(self._sin, s.encode('utf-8') if self._binary else s)
 
     def output_get(self):
-        ...
+        if self._sout is None:
+            return NotImplemented
+        return self._sout.getvalue()
 
     def error_get(self):
-        ...
+        if self._serr is None:
+            return NotImplemented
+        return self._serr.getvalue()
 
 
-class Blank:
-    pass
+def stdio(input=None, output=None, error=None, binary=False) -> ContextManager[Std]:
+    """
+    Redirect standard streams
+    :param input: str or bytes to read from, True for an empty buffer filled by `input_write`, or a file-like object,
+    binary file objects are read as utf-8 text
+    :param output: True to capture into a buffer read by `output_get`, or a file-like object
+    :param error: True to capture into a buffer read by `error_get`, or a file-like object
+    :param binary: bytes mode, captured values are bytes and binary file objects are wrapped into text streams
+    """
 
+    return Std(input, output, error, binary)
 
-@contextmanager
-def stdio(input=None, output=None, error=None) -> ContextManager[Std]:
-    current = sys.stdin, sys.stdout, sys.stderr
 
-    cm = init_stdio_cm()
+def is_binary_stream(obj):
+    # spooled temporary files are not `BufferedIOBase`
+    mode = getattr(obj, 'mode', None)
+    return isinstance(obj, (BufferedIOBase, RawIOBase)) or isinstance(mode, str) and 'b' in mode
 
-    mask_input(cm, input)
-    mask_output(cm, output)
-    mask_error(cm, error)
 
-    try:
-        yield cm
-    finally:
-        sys.stdin, sys.stdout, sys.stderr = current
+def to_text(data):
+    """
+    :param data: str, bytes or a file-like object, the file is read and closed
+    """
 
+    if hasattr(data, 'read'):
+        with data:
+            data = data.read()
+    return data.decode('utf-8') if isinstance(data, bytes) else data
 
-def mask_error(cm, error):
-    if error is not None:
-        if isinstance(error, bool) and error:
-            serr = StringIO()
-            sys.stderr = serr
-            cm.error_get = serr.getvalue
-        else:
-            sys.stderr = error
 
+def to_bytes(data):
+    return data.encode('utf-8') if isinstance(data, str) else data
 
-def mask_output(cm, output):
-    if output is not None:
-        if isinstance(output, bool) and output:
-            sout = StringIO()
-            sys.stdout = sout
-            cm.output_get = sout.getvalue
-        else:
-            sys.stdout = output
+
+class Tokens:
+    """
+    Fast reader of whitespace separated tokens, it reads the whole stream at once.
+    Bytes are read from `sys.stdin.buffer` when it is available, so do not mix it with `input()`.
+    """
+
+    __slots__ = ('_tokens',)
+
+    def __init__(self, stream=None):
+        stream = sys.stdin if stream is None else stream
+        buffer = getattr(stream, 'buffer', None)
+        data = stream.read() if buffer is None else buffer.read()
+        self._tokens = iter(data.split())
+
+    def __iter__(self):
+        return self._tokens
+
+    def __next__(self):
+        return next(self._tokens)
+
+    def next_int(self):
+        return int(next(self._tokens))
+
+    def next_ints(self, n):
+        return [int(next(self._tokens)) for _ in range(n)]
+
+    def next_str(self):
+        return to_text(next(self._tokens))
 
 
 def special_write(sb, s):
@@ -60,25 +280,3 @@ def special_write(sb, s):
     sb.seek(0, SEEK_END)
     sb.write(s)
     sb.seek(pos)
-
-
-def mask_input(cm, input):
-    if input is not None:
-        if isinstance(input, bool) and input:
-            sin = StringIO()
-            sys.stdin = sin
-            cm.input_write = lambda s: special_write(sin, s)
-        elif isinstance(input, str):
-            sin = StringIO(input)
-            sys.stdin = sin
-            cm.input_write = lambda s: special_write(sin, s)
-        else:
-            sys.stdin = input
-
-
-def init_stdio_cm():
-    cm = Blank()
-    cm.input_write = lambda s: NotImplemented
-    cm.output_get = lambda: NotImplemented
-    cm.error_get = lambda: NotImplemented
-    return cm
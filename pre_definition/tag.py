@@ -3,6 +3,30 @@ def dataset(f):
     return f
 
 
-def wrong(f):
-    f.is_wrong = True
+def binary(f):
+    """
+    Mark solver or reader working in bytes mode, its stdio gets `sys.stdin.buffer` and `sys.stdout.buffer`
+    """
+
+    f.is_binary = True
     return f
+
+
+def is_binary(f):
+    return getattr(f, 'is_binary', False)
+
+
+def wrong(f=None, slow=False):
+    """
+    Mark wrong solution, can be used as `@wrong` or `@wrong(slow=True)`
+    :param slow: solution gives right answers, but has to exceed time limit at least on one test
+    """
+
+    def _decor(f):
+        f.is_wrong = True
+        f.is_slow = slow
+        return f
+
+    if f is None:
+        return _decor
+    return _decor(f)
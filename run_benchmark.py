@@ -0,0 +1,250 @@
+import logging as log
+import sys
+from argparse import ArgumentParser
+from collections.abc import Iterable as ABCIterable
+from functools import partial
+from inspect import signature
+from io import BytesIO, StringIO
+from math import ceil, exp, log as ln, sqrt
+from statistics import median
+from time import perf_counter
+
+from extra.cache import add_cache_arguments, cache_from_args
+from extra.introspection import collect_datasets
+from implementation.solver import input_reader, solver as solve
+from pre_definition.params import call_printer, convert_params, parse_comma_sep_ids
+from pre_definition.solve_caller import call_with_args
+from pre_definition.stdio import stdio
+from pre_definition.tag import is_binary
+
+# shortest measurable sample in seconds and the largest batch of calls to reach it
+MIN_SAMPLE = 0.01
+MAX_BATCH = 10_000
+
+# growth models as log of complexity function g, fitted as t = a * g(n) + b, where b is the constant overhead of a call
+MODELS = {
+    'n': lambda n: ln(n),
+    'n log n': lambda n: ln(n) + ln(ln(n)),
+    'n^2': lambda n: 2 * ln(n),
+    '2^n': lambda n: n * ln(2),
+}
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description='Measure solver runtime over input sizes and fit its growth curve.')
+    parser.add_argument('-p', '--param', default='n',
+                        help='generator parameter (and solver argument) holding the input size (default: n)')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=None,
+                        help='sizes to measure (default: sweep over `@params` ranges of the parameter)')
+    parser.add_argument('--points', type=int, default=8,
+                        help='number of sizes in the default sweep (default: 8)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='runs per size, the median is taken (default: 5)')
+    parser.add_argument('-t', '--target', type=int, default=None,
+                        help='size to extrapolate runtime at (default: the largest test of datasets)')
+    add_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    log.basicConfig(level=log.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+    log.info(f'--- Started: {sys.argv[0]} ---')
+
+    args = parse_args(argv)
+    assert args.points > 1, '`--points` should be at least 2!'
+    assert args.repeat > 0, '`--repeat` should be a positive integer!'
+    cache_from_args(args)
+
+    datasets = collect_datasets()
+    groups = find_sized_groups(datasets, args.param)
+    assert groups, f'No `@params` generator has "{args.param}" parameter!'
+
+    sizes = args.sizes or sweep_sizes(groups, args.param, args.points)
+    log.info(f'Sizes: {sizes}')
+
+    timings = []
+    for size in sizes:
+        data = generate_sized(groups, args.param, size)
+        t = measure(data, args.repeat)
+        timings.append((size, t))
+        log.info(f'{args.param}={size}: {t:.6f}s')
+
+    fits = fit_models([(n, t) for n, t in timings if n > 1 and t > 0])
+    assert fits, 'Not enough measurements to fit growth curve!'
+
+    if args.target is None:
+        target, target_name = find_largest_test(datasets, args.param)
+    else:
+        target, target_name = args.target, 'command line'
+
+    report(fits, args.param, target, target_name)
+
+
+def find_sized_groups(datasets, param):
+    """
+    :return: list of (generator, declared params, axis of the size parameter)
+    """
+
+    groups = []
+    for name, ds in datasets:
+        declared = getattr(ds, 'params', None)
+        if declared is None:
+            continue
+        for names, values in declared:
+            if parse_comma_sep_ids(names) == [param] and isinstance(values, (range, list, tuple)):
+                log.debug(f'Dataset "{name}" has been used for sweep')
+                groups.append((ds.generator, declared, values))
+    return groups
+
+
+def sweep_sizes(groups, param, points):
+    lo = min(min(axis) for _, _, axis in groups)
+    hi = max(max(axis) for _, _, axis in groups)
+    lo = max(lo, 2)
+    assert lo < hi, f'Parameter "{param}" range is too narrow to sweep!'
+
+    # geometric progression, sizes grow evenly in log scale, snapped into declared ranges
+    ratio = (hi / lo) ** (1 / (points - 1))
+    return sorted({snap_size(groups, round(lo * ratio ** i)) for i in range(points)})
+
+
+def snap_size(groups, size):
+    return min((min(max(size, min(axis)), max(axis)) for _, _, axis in groups), key=lambda x: abs(x - size))
+
+
+def generate_sized(groups, param, size):
+    """
+    Run the first generator accepting `size`, other parameters take their first values
+    """
+
+    for generator, declared, axis in groups:
+        if min(axis) <= size <= max(axis):
+            break
+    else:
+        generator, declared, _ = groups[-1]
+        log.warning(f'{param}={size} is out of `@params` ranges')
+
+    pinned = [(names, [size] if parse_comma_sep_ids(names) == [param] else [next(iter(values))])
+              for names, values in declared]
+    ps = next(iter(convert_params(pinned)))
+    return call_printer(generator, ps)
+
+
+def measure(data, repeat):
+    """
+    :return: median seconds per solver call, fast calls are batched to get measurable samples
+    """
+
+    number = 1
+    times = []
+    for _ in range(repeat + 1):
+        # solver may change its input, so every call gets a freshly read one
+        inputs = []
+        for _ in range(number):
+            with stdio(input=data, binary=is_binary(input_reader)):
+                inputs.append(input_reader())
+
+        with stdio(output=BytesIO() if is_binary(solve) else StringIO(), binary=is_binary(solve)):
+            start = perf_counter()
+            for input in inputs:
+                call_with_args(solve, input)
+            elapsed = perf_counter() - start
+        times.append(elapsed / number)
+
+        if len(times) == 1:
+            # the first run only calibrates the batch size
+            number = max(1, min(MAX_BATCH, ceil(MIN_SAMPLE / max(elapsed, 1e-9))))
+
+    return median(times[1:])
+
+
+def fit_models(timings):
+    """
+    Fit every model by least squares of errors relative to measured times, so small sizes dominated by
+    the overhead of a call go to `b` instead of skewing the growth
+    :return: list of (model name, function of size predicting seconds, rms relative error) sorted by error
+    """
+
+    top = max(n for n, _ in timings)
+    ts = [t for _, t in timings]
+    fits = []
+    for name, lg in MODELS.items():
+        # g(n) / g(top) keeps exponential models finite
+        xs = [exp(lg(n) - lg(top)) for n, _ in timings]
+        a, b = fit_linear(xs, ts)
+        error = sqrt(sum(((a * x + b) / t - 1) ** 2 for x, t in zip(xs, ts)) / len(ts))
+        fits.append((name, partial(predict, lg, top, a, b), error))
+    return sorted(fits, key=lambda x: x[2])
+
+
+def fit_linear(xs, ts):
+    """
+    Weighted least squares of t = a * x + b with weights 1 / t^2, a and b are not negative
+    :return: (a, b)
+    """
+
+    ws = [1 / t ** 2 for t in ts]
+    sw = sum(ws)
+    sx = sum(w * x for w, x in zip(ws, xs))
+    sxx = sum(w * x * x for w, x in zip(ws, xs))
+    st = sum(w * t for w, t in zip(ws, ts))
+    sxt = sum(w * x * t for w, x, t in zip(ws, xs, ts))
+
+    det = sxx * sw - sx * sx
+    if det > 0:
+        a = (sxt * sw - sx * st) / det
+        b = (sxx * st - sx * sxt) / det
+        if a < 0:
+            # runtime does not grow at all
+            return 0.0, st / sw
+        if b >= 0:
+            return a, b
+    # no measurable overhead
+    return sxt / sxx, 0.0
+
+
+def predict(lg, top, a, b, n):
+    return a * exp(lg(n) - lg(top)) + b if a else b
+
+
+def find_largest_test(datasets, param):
+    sig = signature(solve)
+    largest, largest_name = None, None
+    for name, ds in datasets:
+        for dsno, data in enumerate(ds(), start=1):
+            with stdio(input=data, binary=is_binary(input_reader)):
+                input = input_reader()
+            if hasattr(data, 'close'):
+                data.close()
+            size = bind_arguments(sig, input).get(param)
+            if isinstance(size, int) and (largest is None or size > largest):
+                largest, largest_name = size, f'"{name}" #{dsno}'
+
+    assert largest is not None, f'Solver has no integer argument "{param}", use `--target`!'
+    return largest, largest_name
+
+
+def bind_arguments(sig, args):
+    # same dispatch as `call_with_args`
+    if isinstance(args, dict):
+        return sig.bind(**args).arguments
+    elif isinstance(args, ABCIterable):
+        return sig.bind(*args).arguments
+    else:
+        return sig.bind(args).arguments
+
+
+def report(fits, param, target, target_name):
+    best = fits[0][0]
+    log.info(f'Growth curve: O({best})')
+    for name, f, error in fits:
+        try:
+            estimate = f'{f(target):.3f}s'
+        except OverflowError:
+            estimate = 'astronomically long'
+        mark = ' <- best fit' if name == best else ''
+        log.info(f'  O({name}): rms error {error:.3f}, at {param}={target} ({target_name}): {estimate}{mark}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,72 +1,240 @@
+import json
 import logging as log
+import shutil
 import sys
+from argparse import ArgumentParser
+from functools import partial
+from hashlib import sha256
 from pathlib import Path
+from uuid import uuid4
 
-from extra.helper import clear_dir
-from extra.introspection import collect_datasets
+from extra.cache import add_cache_arguments, cache_from_args, read_input
+from extra.helper import clear_dir, create_executor, link_file, remove_stale
+from extra.introspection import collect_datasets, find_dataset
+from extra.limits import NO_LIMITS, OK, LimitException, Peak, add_limits_arguments, call_limited, limits_from_args
+from extra.sources import local_sources
 from implementation.solver import input_reader, solver as solve
-from pre_definition.solve_caller import call_with_args
-from pre_definition.stdio import stdio
-
-
-def main():
+from pre_definition.stdio import to_bytes
+from pre_definition.tag import is_binary
+
+MANIFEST = 'manifest.json'
+# the solver and the code running it, local modules they import are fingerprinted as well
+SOLVER_MODULES = [Path('implementation/solver.py'), Path('extra/limits.py')]
+# block size for copying and hashing spilled tests
+BLOCK_SIZE = 1024 * 1024
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description='Build dataset files for every generator group.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes for test generation and solving (default: 1)')
+    parser.add_argument('--threads', action='store_true',
+                        help='use threads with context-local stdio instead of worker processes')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help=f'keep unchanged tests and re-solve only the changed ones (uses "{MANIFEST}")')
+    add_limits_arguments(parser)
+    add_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     log.basicConfig(level=log.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
     log.info(f'--- Started: {sys.argv[0]} ---')
 
+    args = parse_args(argv)
+    assert args.jobs > 0, '`--jobs` should be a positive integer!'
+    limits = limits_from_args(args)
+    log.info(f'Limits per test: {limits}')
+    cache_from_args(args)
+
     datasets = collect_datasets()
     dsnowidth = len(str(len(datasets)))
 
     dsdir = Path('dataset')
     assert dsdir.exists() and dsdir.is_dir()
 
-    clear_dir(dsdir)
+    manifest_file = dsdir / MANIFEST
+    if args.incremental:
+        manifest = read_manifest(manifest_file)
+    else:
+        clear_dir(dsdir)
+        manifest = {}
 
     fulldir = dsdir / 'full'
     fulldir.mkdir(exist_ok=True)
     log.debug(f'Dir "{fulldir}" has been created')
 
     try:
-        build_datasets(datasets, dsdir, dsnowidth, fulldir)
+        if args.jobs == 1:
+            manifest = build_datasets(datasets, dsdir, dsnowidth, fulldir, manifest=manifest, limits=limits)
+        else:
+            with create_executor(args.jobs, args.threads) as pool:
+                manifest = build_datasets(datasets, dsdir, dsnowidth, fulldir, mapper=pool.map, manifest=manifest,
+                                          limits=limits)
     except Exception:
         log.exception(f'Failed to build dataset')
+        # half-built dataset does not match any manifest, next run has to rebuild everything
+        manifest_file.unlink(missing_ok=True)
         quit(-1)
 
+    prune_dataset(dsdir, manifest)
+    manifest_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
     log.info(f'Dataset has been build')
 
 
-def build_datasets(datasets, dsdir, dsnowidth, fulldir):
+def read_manifest(manifest_file: Path):
+    if not manifest_file.exists():
+        log.info(f'No manifest "{manifest_file}", building from scratch')
+        return {}
+
+    try:
+        return json.loads(manifest_file.read_text())
+    except ValueError:
+        log.warning(f'Broken manifest "{manifest_file}", building from scratch')
+        return {}
+
+
+def prune_dataset(dsdir: Path, manifest):
+    """
+    Delete files of tests left from the previous build
+    """
+
+    keep = {MANIFEST, *manifest['tests'], *manifest['links']}
+    keep |= {Path(p).with_suffix('.out').as_posix() for p in keep}
+    remove_stale(dsdir, keep)
+
+
+def fingerprint(*chunks: bytes):
+    h = sha256()
+    for chunk in chunks:
+        h.update(sha256(chunk).digest())
+    return h.hexdigest()
+
+
+def fingerprint_file(path: Path):
+    # the same as `fingerprint` of the file content, but it is read by blocks
+    h = sha256()
+    with path.open('rb') as f:
+        for block in iter(partial(f.read, BLOCK_SIZE), b''):
+            h.update(block)
+    return sha256(h.digest()).hexdigest()
+
+
+def build_datasets(datasets, dsdir, dsnowidth, fulldir, mapper=map, manifest=None, limits=NO_LIMITS):
+    """
+    Generate all groups, write tests and solve them.
+    Every test is solved once in its group dir, `full` gets links to the same files.
+    Tests with the same input and solver fingerprint as in `manifest` are left untouched.
+    :param mapper: `map`-like callable, e.g. `map` or `Executor.map` for parallel build
+    :param manifest: manifest of the previous build, empty or None to build everything
+    :param limits: limits for every solver call, a test breaking them fails the build
+    :return: manifest of the current build
+    """
+
+    old = manifest or {}
+    old_tests = old.get('tests', {})
+    old_links = old.get('links', {})
+
+    solver_fp = fingerprint(*(src.read_bytes() for src in local_sources(SOLVER_MODULES)))
+    solver_changed = old.get('solver') != solver_fp
+
+    names = [name for name, _ in datasets]
+    new_tests = dict()
+    new_links = dict()
+    tests = []
+    to_solve = []
+
     fullno = 0
-    for dsno, (name, ds) in enumerate(datasets, start=1):
+    groups = mapper(partial(generate_group, spooldir=dsdir), names)
+    for dsno, (name, group) in enumerate(zip(names, groups), start=1):
         currdir = dsdir / f'{dsno:0{dsnowidth}}_{name}'
         currdir.mkdir(exist_ok=True)
         log.debug(f'Dir "{currdir}" has been created')
 
-        for testno, data in enumerate(ds(), start=1):
+        for testno, data in enumerate(group, start=1):
             fullno += 1
 
-            fulltest = fulldir / f'{fullno}.in'
-            fulltest.write_text(data, encoding='utf-8')
-            log.debug(f'Test file "{fulltest}" has been written')
-
-            solve_file(fulltest)
-            log.debug(f'Test file "{fulltest}" has been solved')
-
             currtest = currdir / f'{testno}.in'
-            currtest.write_text(data, encoding='utf-8')
-            log.debug(f'Test file "{currtest}" has been written')
-
-            solve_file(currtest)
-            log.debug(f'Test file "{currtest}" has been solved')
-
-
-def solve_file(input_file: Path):
-    with stdio(input=input_file.open()):
-        input = input_reader()
+            fulltest = fulldir / f'{fullno}.in'
+            currkey = currtest.relative_to(dsdir).as_posix()
+            fullkey = fulltest.relative_to(dsdir).as_posix()
+
+            spilled = isinstance(data, Path)
+            if spilled:
+                new_tests[currkey] = fingerprint_file(data)
+            else:
+                content = to_bytes(data)
+                new_tests[currkey] = fingerprint(content)
+            new_links[fullkey] = currkey
+
+            written = old_tests.get(currkey) != new_tests[currkey] or not currtest.exists()
+            if written:
+                # never rewrite in place: the old inode may still be linked from `full`
+                currtest.unlink(missing_ok=True)
+                if spilled:
+                    data.replace(currtest)
+                else:
+                    currtest.write_bytes(content)
+                log.debug(f'Test file "{currtest}" has been written')
+            elif spilled:
+                data.unlink()
+
+            touched = written or solver_changed or not currtest.with_suffix('.out').exists()
+            if touched:
+                to_solve.append(currtest)
+
+            relink = touched or old_links.get(fullkey) != currkey or not fulltest.exists()
+            tests.append((currtest, fulltest, relink))
+
+    log.info(f'Tests to solve: {len(to_solve)} / {len(tests)}')
+    peak = Peak()
+    for currtest, run in zip(to_solve, mapper(partial(solve_file, limits=limits), to_solve)):
+        log.debug(f'Test file "{currtest}" has been solved')
+        peak.update(f'"{currtest}"', run)
+    peak.report('Solver')
+
+    for currtest, fulltest, relink in tests:
+        if not relink:
+            continue
+        for suffix in ['.in', '.out']:
+            fulltest.with_suffix(suffix).unlink(missing_ok=True)
+            link_file(currtest.with_suffix(suffix), fulltest.with_suffix(suffix))
+        log.debug(f'Test file "{fulltest}" has been linked')
+
+    return {'solver': solver_fp, 'tests': new_tests, 'links': new_links}
+
+
+def generate_group(name, spooldir: Path):
+    """
+    Generators are looked up by name, so the call is picklable for worker processes.
+    Tests spilled into temporary files are moved to files in `spooldir` and returned as paths.
+    """
+
+    return [spool_to_file(data, spooldir) if hasattr(data, 'read') else data
+            for data in find_dataset(name)()]
+
+
+def spool_to_file(spool, spooldir: Path):
+    # created as any other test file, it becomes one by rename
+    path = spooldir / f'.{uuid4().hex}.spill'
+    with spool, path.open('xb') as f:
+        shutil.copyfileobj(spool, f, BLOCK_SIZE)
+    return path
+
+
+def solve_file(input_file: Path, limits=NO_LIMITS):
+    binary = is_binary(input_reader)
+    with input_file.open('rb' if binary else 'r') as f:
+        input, _ = read_input(f)
 
     output_file = input_file.with_suffix('.out')
+    output_file.unlink(missing_ok=True)
+
+    run = call_limited(solve, input, limits, output=output_file)
+    if run.verdict != OK:
+        raise LimitException(run)
 
-    with stdio(output=output_file.open('w')):
-        call_with_args(solve, input)
+    return run
 
 
 if __name__ == '__main__':
@@ -1,20 +1,24 @@
 import ast
 import logging as log
 import sys
-from importlib import import_module
-from inspect import getfile, getmodule
-from itertools import filterfalse
+from argparse import ArgumentParser
+from collections import defaultdict
 from pathlib import Path
-from runpy import run_path
 from typing import Type, Iterable
 
 from astunparse import unparse
 
-from extra.introspection import collect_datasets
-from pre_definition.stdio import stdio
+from extra.sources import find_file, is_local_file
+from pre_definition.clue import PACKINGS, ZLIB, bake_tests
+from pre_definition.stdio import stdio, to_text
+from pre_definition.tag import is_binary
 
 AST_IMPORTS = [ast.Import, ast.ImportFrom]
-AST_NEW_NAMES = [ast.Assign, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef]
+# functions of my.py called by Stepik
+ROOTS = ['generate', 'check', 'solve']
+AST_NEW_NAMES = [ast.Assign, ast.AnnAssign, ast.AugAssign, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef]
+# decorators making a generator function a dataset
+DATASET_DECORATORS = ['params', 'dataset']
 
 
 def is_any_samefile(target: Path, collection: Iterable[Path]):
@@ -34,8 +38,9 @@ def parse_module(modpath: Path, local_modules: Iterable[Path]):
         - Non local Imports
         - Source Code
         - Local names
+    Module is never executed, names are found on its AST.
     :param modpath:
-    :return: Non local Imports, Module Source Code, Local names
+    :return: Non local Imports, Module Statements, Local names
     """
 
     # read file
@@ -44,19 +49,33 @@ def parse_module(modpath: Path, local_modules: Iterable[Path]):
     # parse file
     ast_obj = ast.parse(content)
 
+    statements = list(localize_imports(ast_obj, local_modules))
+
     nonlocal_imports = find_nonlocal_imports(ast_obj, local_modules)
-    source_code = find_module_sourcecode(ast_obj)
-    local_names = set(filter_local_names(modpath, ast_obj))
+    local_names = set(filter_local_names(statements))
+
+    return nonlocal_imports, statements, local_names
 
-    return nonlocal_imports, source_code, local_names
 
+def localize_imports(ast_obj, local_modules):
+    """
+    Drop imports, local modules are merged into my.py, so their names aliased on import become assignments
+    :return: module statements
+    """
 
-def filter_local_names(modpath, ast_obj):
-    namedefs = filter(factory_is_any_isinstance(AST_NEW_NAMES), ast_obj.body)
-    ast_names = set(extract_names(namedefs))
-    mdl_names = set(run_path(modpath))
+    for stmt in ast_obj.body:
+        if isinstance(stmt, ast.ImportFrom) and is_local_module(stmt.module, local_modules):
+            for nm in stmt.names:
+                if nm.asname is not None and nm.asname != nm.name:
+                    yield ast.Assign(targets=[ast.Name(id=nm.asname, ctx=ast.Store())],
+                                     value=ast.Name(id=nm.name, ctx=ast.Load()), lineno=stmt.lineno)
+        elif not factory_is_any_isinstance(AST_IMPORTS)(stmt):
+            yield stmt
 
-    return ast_names.intersection(mdl_names)
+
+def filter_local_names(statements):
+    namedefs = filter(factory_is_any_isinstance(AST_NEW_NAMES), statements)
+    return extract_names(namedefs)
 
 
 def extract_names(namedefs):
@@ -64,8 +83,16 @@ def extract_names(namedefs):
         if isinstance(df, ast.ClassDef) or isinstance(df, ast.FunctionDef) or isinstance(df, ast.AsyncFunctionDef):
             yield df.name
         elif isinstance(df, ast.Assign):
-            assert len(df.targets) == 1
-            for nm in flatten_target(df.targets[0]):
+            for target in df.targets:
+                for nm in flatten_target(target):
+                    yield nm
+        elif isinstance(df, ast.AnnAssign):
+            # bare annotation does not bind a name
+            if df.value is not None:
+                for nm in flatten_target(df.target):
+                    yield nm
+        elif isinstance(df, ast.AugAssign):
+            for nm in flatten_target(df.target):
                 yield nm
         else:
             assert False, 'Impossible!'
@@ -74,31 +101,127 @@ def extract_names(namedefs):
 def flatten_target(df):
     if isinstance(df, ast.Name):
         yield df.id
-    elif isinstance(df, ast.Tuple):
+    elif isinstance(df, ast.Tuple) or isinstance(df, ast.List):
         for tdf in df.elts:
             for nm in flatten_target(tdf):
                 yield nm
+    elif isinstance(df, ast.Starred):
+        for nm in flatten_target(df.value):
+            yield nm
+    elif isinstance(df, ast.Attribute) or isinstance(df, ast.Subscript):
+        # changes an existing object, no new name
+        return
     else:
         assert False, 'Impossible!'
 
 
-def find_module_sourcecode(ast_obj):
-    # filtering statements
-
-    rest = filterfalse(factory_is_any_isinstance(AST_IMPORTS), ast_obj.body)
-
+def find_module_sourcecode(statements):
     # finalize extraction
-    source_code = '\n'.join(map(unparse, rest))
+    source_code = '\n'.join(map(unparse, statements))
 
     return source_code
 
 
+def shake(enriched, roots):
+    """
+    Tree shaking: keep only statements and imports reachable from `roots`.
+    Statements binding no names are kept as is, as well as everything they use.
+    Names are collected over the whole statement, so a local variable may keep a global of the same name.
+    :param enriched: list of (path, (nonlocal imports, statements, local names))
+    :return: `enriched` with unreachable statements and imports dropped
+    """
+
+    defining = defaultdict(list)
+    kept = set()
+    queue = list(roots)
+    for _, (_, statements, _) in enriched:
+        for stmt in statements:
+            names = list(filter_local_names([stmt]))
+            for nm in names:
+                defining[nm].append(stmt)
+            if not names:
+                kept.add(id(stmt))
+                queue.extend(used_names(stmt))
+
+    used = set()
+    while queue:
+        nm = queue.pop()
+        if nm in used:
+            continue
+        used.add(nm)
+        for stmt in defining[nm]:
+            if id(stmt) not in kept:
+                kept.add(id(stmt))
+                queue.extend(used_names(stmt))
+
+    return [(p, (list(shake_imports(imps, used)), [stmt for stmt in statements if id(stmt) in kept], names))
+            for p, (imps, statements, names) in enriched]
+
+
+def used_names(stmt):
+    return {node.id for node in ast.walk(stmt) if isinstance(node, ast.Name)}
+
+
+def shake_imports(imps, used):
+    for imp in imps:
+        # `import a.b` binds `a`
+        bound = [nm for nm in imp.names
+                 if nm.name == '*' or (nm.asname or nm.name.split('.')[0] if isinstance(imp, ast.Import)
+                                       else nm.asname or nm.name) in used]
+        if len(bound) == len(imp.names):
+            yield imp
+        elif bound and isinstance(imp, ast.ImportFrom):
+            yield ast.ImportFrom(module=imp.module, names=bound, level=imp.level)
+
+
+def strip_docstrings(statements):
+    for stmt in statements:
+        if is_docstring(stmt):
+            continue
+        for node in ast.walk(stmt):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and is_docstring(node.body[0]):
+                node.body = node.body[1:] or [ast.Pass()]
+        yield stmt
+
+
+def is_docstring(stmt):
+    return isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str)
+
+
+def drop_blank_lines(source_code):
+    # string literals are unparsed with escaped newlines, so blank lines never belong to them
+    return '\n'.join(line for line in source_code.split('\n') if line.strip())
+
+
+def merge_imports(imps):
+    """
+    Drop repeated imports of modules merged into my.py, names imported from the same module are joined
+    :param imps: imports with a single name for `ast.Import`, as `filter_imports` gives them
+    """
+
+    merged = dict()
+    for imp in imps:
+        if isinstance(imp, ast.Import):
+            key = ('import', imp.names[0].name, imp.names[0].asname)
+        else:
+            key = ('from', imp.module, imp.level)
+        names = merged.setdefault(key, dict())
+        for nm in imp.names:
+            names.setdefault((nm.name, nm.asname), nm)
+
+    for (kind, module, level), names in merged.items():
+        if kind == 'import':
+            yield ast.Import(names=list(names.values()))
+        else:
+            yield ast.ImportFrom(module=module, names=list(names.values()), level=level)
+
+
 def find_nonlocal_imports(ast_obj, local_modules):
     # filtering statements
     imps = filter(factory_is_any_isinstance(AST_IMPORTS), ast_obj.body)
 
     # finalize extraction
-    nonlocal_imports = '\n'.join(filter_imports(imps, local_modules))
+    nonlocal_imports = list(filter_imports(imps, local_modules))
 
     return nonlocal_imports
 
@@ -106,45 +229,124 @@ def find_nonlocal_imports(ast_obj, local_modules):
 def filter_imports(imps, forbidden):
     for imp in imps:
         if isinstance(imp, ast.ImportFrom):
-            m = import_module(imp.module)
-            f = find_file(m)
-            if f is None or not is_any_samefile(f, forbidden):
-                yield unparse(imp)
+            if not is_local_module(imp.module, forbidden):
+                yield imp
         elif isinstance(imp, ast.Import):
             for nm in imp.names:
-                m = import_module(nm.name)
-                f = find_file(m)
-                if f is None or not is_any_samefile(f, forbidden):
-                    yield unparse(ast.Import([nm]))
+                if not is_local_module(nm.name, forbidden):
+                    yield ast.Import([nm])
         else:
             assert False, 'Impossible!'
 
 
-def find_file(obj):
-    if obj is None:
-        return None
-    module = getmodule(obj)
+def is_local_module(name, local_modules):
+    f = find_file(name)
+    return f is not None and is_any_samefile(f, local_modules)
 
-    if module is None:
-        return None
-    try:
-        return Path(getfile(module))
-    except TypeError:
-        return None
 
+def parse_args(argv=None):
+    parser = ArgumentParser(description='Compile my.py for Stepik out of implementation and pre-definition modules.')
+    parser.add_argument('--full', action='store_true',
+                        help='keep every statement of compiled modules instead of only reachable from '
+                             f'{", ".join(f"`{nm}`" for nm in ROOTS)}')
+    parser.add_argument('--minify', action='store_true',
+                        help='strip docstrings and blank lines')
+    parser.add_argument('--prebake', action='store_true',
+                        help='generate and solve tests now and embed them into my.py, so `generate()` only decodes them')
+    parser.add_argument('--clue', choices=PACKINGS, default=ZLIB,
+                        help=f'format of clues returned by `generate()`, texts are compressed only where it makes '
+                             f'them shorter, "digest" keeps only a digest of expected output and fits only checkers '
+                             f'comparing it for equality (default: {ZLIB})')
+    return parser.parse_args(argv)
+
+
+def find_dataset_names(modpath: Path):
+    """
+    Datasets of generator module found on its AST, so nothing is executed. Datasets are top level names bound by
+        - functions decorated with one of `DATASET_DECORATORS` or their aliases,
+        - assignments of their calls, e.g. `doubled = params(...)(twice)`,
+        - imports of datasets from local modules.
+    :return: names in order of definition
+    """
+
+    decorators = set(DATASET_DECORATORS)
+    names = []
+    for stmt in ast.parse(modpath.read_text()).body:
+        if isinstance(stmt, ast.FunctionDef):
+            if any(is_dataset_decorator(node, decorators) for node in stmt.decorator_list):
+                names.append(stmt.name)
+        elif isinstance(stmt, ast.Assign):
+            if isinstance(stmt.value, ast.Call) and is_dataset_decorator(stmt.value.func, decorators):
+                names.extend(nm for target in stmt.targets for nm in flatten_target(target))
+        elif isinstance(stmt, ast.ImportFrom) and not stmt.level:
+            # `from pre_definition.tag import dataset as ds`
+            decorators.update(nm.asname for nm in stmt.names if nm.asname and nm.name in DATASET_DECORATORS)
+            names.extend(imported_dataset_names(stmt))
+    return names
+
+
+def imported_dataset_names(imp: ast.ImportFrom):
+    f = find_file(imp.module)
+    if f is None or f.suffix != '.py' or not is_local_file(f, Path('.')):
+        return []
+
+    datasets = find_dataset_names(f)
+    return [nm.asname or nm.name for nm in imp.names if nm.name in datasets]
+
+
+def is_dataset_decorator(node, decorators=DATASET_DECORATORS):
+    return decorator_name(node) in decorators
+
+
+def decorator_name(node):
+    # `@params(...)`, `@dataset` or `@tag.dataset`
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def prepare_template(clue_packing, ds_names, prebaked=None):
+    """
+    :param ds_names: names of dataset functions of generator module
+    :param prebaked: blob of pre-baked tests, None to generate tests on the platform
+    """
 
-def prepare_template():
     tpl = Path('extra/template.py.tpl')
-    ds_names = [name for name, _ in collect_datasets()]
+    assert ds_names, 'No datasets'
     tplpy = tpl.with_suffix('')
 
     s = tpl.read_text()
     s = s.replace('DATASETS_FUNCTIONS', f'[{", ".join(ds_names)}]')
+    s = s.replace('CLUE_PACKING', repr(clue_packing))
+    s = s.replace('PREBAKED_BLOB', repr(prebaked))
+    s = s.replace('SOLVED_TESTS', 'generated_tests' if prebaked is None else 'baked_tests')
     tplpy.write_text(s)
 
     return tplpy
 
 
+def prebake_tests(datasets):
+    """
+    :return: list of (input, expected output) as `generate()` of my.py would produce them
+    """
+
+    # generator and solver are executed only to pre-bake tests
+    from extra.limits import call_limited
+    from implementation.solver import input_reader, solver
+
+    tests = []
+    for name, f in datasets:
+        for ds in f():
+            ds = to_text(ds)
+            with stdio(input=ds, binary=is_binary(input_reader)):
+                input_data = input_reader()
+            tests.append((ds, call_limited(solver, input_data).output))
+        log.info(f'Dataset "{name}" has been pre-baked')
+    return tests
+
+
 def assert_clashed_names(enriched):
     saved = dict()
     has_clashed = False
@@ -158,27 +360,45 @@ def assert_clashed_names(enriched):
     assert not has_clashed, 'Some names are not unique!'
 
 
-def main():
+def main(argv=None):
     log.basicConfig(level=log.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
     log.info(f'--- Started: {sys.argv[0]} ---')
 
+    args = parse_args(argv)
+    log.info(f'Clue packing: {args.clue}')
+
     mdl_caller = Path('pre_definition/solve_caller.py')
     mdl_tag = Path('pre_definition/tag.py')
     mdl_stdio = Path('pre_definition/stdio.py')
     mdl_params = Path('pre_definition/params.py')
+    mdl_clue = Path('pre_definition/clue.py')
 
     mdl_common = Path('implementation/common.py')
     mdl_checker = Path('implementation/checker.py')
     mdl_generator = Path('implementation/generator.py')
     mdl_solution = Path('implementation/solver.py')
 
-    mdl_template = prepare_template()
+    prebaked = None
+    if args.prebake:
+        from extra.introspection import collect_datasets
+
+        datasets = collect_datasets()
+        prebaked = bake_tests(prebake_tests(datasets))
+        log.info(f'Tests have been pre-baked into {len(prebaked)} bytes')
+
+    ds_names = find_dataset_names(mdl_generator)
+    if args.prebake:
+        assert ds_names == [name for name, _ in datasets], \
+            f'Datasets found on generator AST {ds_names} differ from collected ones!'
+    log.info(f'Datasets: {", ".join(ds_names)}')
+    mdl_template = prepare_template(args.clue, ds_names, prebaked)
 
     local_modules = [
         mdl_caller,
         mdl_tag,
         mdl_stdio,
         mdl_params,
+        mdl_clue,
         mdl_common,
         mdl_checker,
         mdl_generator,
@@ -189,14 +409,25 @@ def main():
 
     assert_clashed_names(enriched)
 
+    if not args.full:
+        total = sum(len(statements) for _, (_, statements, _) in enriched)
+        enriched = shake(enriched, ROOTS)
+        kept = sum(len(statements) for _, (_, statements, _) in enriched)
+        log.info(f'Statements kept after tree shaking: {kept} / {total}')
+
     mpy = Path('my.py')
 
     with stdio(output=mpy.open('w')):
-        for _, (imps, _, _) in enriched:
-            print(imps)
+        imps = merge_imports(imp for _, (imps, _, _) in enriched for imp in imps)
+        print('\n'.join(unparse(imp).strip() for imp in imps))
+
+        for _, (_, statements, _) in enriched:
+            if args.minify:
+                print(drop_blank_lines(find_module_sourcecode(strip_docstrings(statements))))
+            else:
+                print(find_module_sourcecode(statements))
 
-        for _, (_, codes, _) in enriched:
-            print(codes)
+    log.info(f'"{mpy}" has been written, {mpy.stat().st_size} bytes')
 
 
 if __name__ == '__main__':
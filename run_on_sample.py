@@ -6,6 +6,7 @@ from implementation.checker import output_reader, checker as check
 from implementation.solver import input_reader, solver as solve, hinter as get_hint
 from pre_definition.solve_caller import call_with_args
 from pre_definition.stdio import stdio
+from pre_definition.tag import is_binary
 
 
 def main():
@@ -37,7 +38,8 @@ def main():
 
 def check_sample(fin: Path, fout: Path):
     # read input
-    with stdio(input=fin.open()):
+    binary = is_binary(input_reader)
+    with fin.open('rb' if binary else 'r') as f, stdio(input=f, binary=binary):
         try:
             input = input_reader()
         except Exception as e:
@@ -50,21 +52,22 @@ def check_sample(fin: Path, fout: Path):
         raise Exception(f'Cannot get hint for "{fin.name}"') from e
 
     # read output
-    with stdio(input=fout.open()):
+    binary = is_binary(output_reader)
+    with fout.open('rb' if binary else 'r') as f, stdio(input=f, binary=binary):
         try:
             expected = call_with_args(output_reader, hint)
         except Exception as e:
             raise Exception(f'Cannot read "{fout.name}"') from e
 
     # run solution
-    with stdio(output=True) as solution:
+    with stdio(output=True, binary=is_binary(solve)) as solution:
         try:
             call_with_args(solve, input)
         except Exception as e:
             raise Exception(f'Cannot solve "{input}"') from e
 
     # read solution output
-    with stdio(input=solution.output_get()):
+    with stdio(input=solution.output_get(), binary=is_binary(output_reader)):
         try:
             answer = call_with_args(output_reader, hint)
         except Exception as e:
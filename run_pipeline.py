@@ -0,0 +1,150 @@
+import logging as log
+import multiprocessing
+import shlex
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from importlib import import_module
+from inspect import signature
+from time import perf_counter
+
+from extra.cache import CACHE_DIR, clear_cache
+from extra.introspection import collect_datasets, warm_datasets
+
+# stage name -> (stages it depends on, module with `main`)
+STAGES = {
+    'sample': ([], 'run_on_sample'),
+    'validation': ([], 'run_validation'),
+    'dataset': (['sample', 'validation'], 'run_build_dataset'),
+    'compilation': ([], 'run_compilation'),
+    'validation_my': (['validation', 'compilation'], 'run_validation_my'),
+}
+
+PASSED = 'passed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def parse_args():
+    parser = ArgumentParser(description='Run all stages, each one in its own process, independent stages run '
+                                        'concurrently.')
+    parser.add_argument('-j', '--jobs', type=int, default=len(STAGES),
+                        help=f'number of stages running at once (default: {len(STAGES)})')
+    parser.add_argument('-a', '--args', action='append', default=[], metavar='STAGE=ARGS',
+                        help=f'command line arguments of a stage, e.g. `-a "dataset=-j 4 -i"`, '
+                             f'stages: {", ".join(STAGES)}')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help=f'delete the on-disk cache "{CACHE_DIR}" first, stages share datasets through it')
+    return parser.parse_args()
+
+
+def configure_logging():
+    log.basicConfig(level=log.INFO, format='%(asctime)s | %(levelname)s | %(processName)s | %(message)s')
+
+
+def main():
+    configure_logging()
+    log.info(f'--- Started: {sys.argv[0]} ---')
+
+    args = parse_args()
+    assert args.jobs > 0, '`--jobs` should be a positive integer!'
+    stage_args = dict()
+    for item in args.args:
+        stage, _, argline = item.partition('=')
+        assert stage in STAGES, f'Unknown stage "{stage}"!'
+        stage_args[stage] = shlex.split(argline)
+
+    if args.clear_cache:
+        clear_cache()
+
+    # stages read tests from the on-disk cache instead of generating them again
+    start = perf_counter()
+    total = warm_datasets(collect_datasets())
+    log.info(f'Datasets have been cached in {perf_counter() - start:.3f}s ({total} tests)')
+
+    # every stage gets a fresh process, so stages may fork and redirect stdio as when they run alone
+    with ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=configure_logging, max_tasks_per_child=1) as pool:
+        results = run_stages(STAGES, stage_args, pool)
+    report(results, perf_counter() - start)
+
+    if any(status != PASSED for status, _ in results.values()):
+        quit(-1)
+
+
+def run_stages(stages, stage_args, pool, runner=None):
+    """
+    Run every stage once all its dependencies have passed, stages depending on failed ones are skipped
+    :param pool: executor running stages
+    :param runner: function of (stage, module, argv) returning (status, seconds), `run_stage` by default
+    :return: dict of stage name -> (status, seconds)
+    """
+
+    runner = runner or run_stage
+    results = dict()
+    running = dict()
+    while len(results) < len(stages):
+        for stage, (deps, module) in stages.items():
+            if stage in results or stage in running.values():
+                continue
+            if any(dep in results and results[dep][0] != PASSED for dep in deps):
+                log.warning(f'Stage "{stage}" has been skipped')
+                results[stage] = SKIPPED, 0.0
+            elif all(dep in results for dep in deps):
+                running[pool.submit(runner, stage, module, stage_args.get(stage, []))] = stage
+
+        if len(results) == len(stages):
+            break
+        assert running, 'Stages have cyclic dependencies!'
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[running.pop(future)] = future.result()
+
+    return results
+
+
+def run_stage(stage, module, argv):
+    multiprocessing.current_process().name = stage
+    # stages log their own script instead of the pipeline one
+    sys.argv = [f'{module}.py', *argv]
+    log.info(f'Stage "{stage}" has been started')
+
+    start = perf_counter()
+    try:
+        # imported here, e.g. `run_validation_my` imports my.py written by `run_compilation`
+        main_func = import_module(module).main
+        if 'argv' in signature(main_func).parameters:
+            # never parses `sys.argv` of the pipeline
+            main_func(argv)
+        else:
+            assert not argv, f'Stage "{stage}" has no arguments!'
+            main_func()
+    except SystemExit as e:
+        # stages report their failures and quit
+        status = PASSED if e.code in (None, 0) else FAILED
+    except Exception as e:
+        log.error(f'Stage "{stage}" has failed', exc_info=False)
+        cause = e
+        while cause:
+            log.error(str(cause), exc_info=False)
+            cause = cause.__cause__
+        status = FAILED
+    else:
+        status = PASSED
+
+    elapsed = perf_counter() - start
+    log.info(f'Stage "{stage}" has {status} in {elapsed:.3f}s')
+    return status, elapsed
+
+
+def report(results, total):
+    log.info('Stages summary:')
+    for stage in STAGES:
+        status, elapsed = results[stage]
+        log.info(f'  {stage:>15}: {status:>7} {elapsed:8.3f}s')
+    log.info(f'  {"total":>15}: {"":>7} {total:8.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,27 @@
 import logging as log
 import sys
-
-from extra.introspection import collect_datasets, collect_wrong_solutions
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from extra.cache import add_cache_arguments, cache_from_args, read_input
+from extra.helper import create_executor
+from extra.introspection import collect_datasets, find_dataset, collect_wrong_solutions
+from extra.limits import (NO_LIMITS, OK, TLE, LimitException, Limits, Peak, add_limits_arguments, call_limited,
+                          limits_from_args)
+from implementation import wrong as wrongs
 from implementation.checker import output_reader, checker as check
-from implementation.solver import input_reader, solver as solve, hinter as get_hint
+from implementation.solver import solver as solve
 from pre_definition.solve_caller import call_with_args
 from pre_definition.stdio import stdio
+from pre_definition.tag import is_binary
+
+
+# time limit for `@wrong(slow=True)` solutions when no limit is given
+SLOW_TIME_LIMIT = 1.0
+# author solution peak time has to be this many times below the slow solutions time limit
+SLOW_MARGIN = 2.0
 
 
 class ValidationException(Exception):
@@ -20,129 +36,283 @@ class PartiallyCorrectException(ValidationException):
     pass
 
 
-def main():
+class WrongRunException(ValidationException):
+    pass
+
+
+class WrongReadException(ValidationException):
+    pass
+
+
+# failures of wrong solutions are reported in this order, as if all of them were run first, read next and checked last
+FAILURES_ORDER = [WrongRunException, WrongReadException, Exception]
+
+
+class Verdict:
+    """
+    Running counters of one solution checked against the author solution
+    """
+
+    def __init__(self):
+        self.correct = 0
+        self.wrong = 0
+        self.first_error = None
+        self.first_full_name = ''
+
+    def check(self, full_name, indata, outdata, ansdata):
+        try:
+            check(indata, outdata, ansdata)
+            self.correct += 1
+        except Exception as e:
+            self.wrong += 1
+            if self.first_error is None:
+                self.first_error = e
+                self.first_full_name = full_name
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description='Validate author solution and wrong solutions on generated datasets.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes checking wrong solutions (default: 1)')
+    parser.add_argument('--threads', action='store_true',
+                        help='use threads with context-local stdio instead of worker processes')
+    add_limits_arguments(parser)
+    add_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     log.info(f'--- Started: {sys.argv[0]} ---')
 
+    args = parse_args(argv)
+    assert args.jobs > 0, '`--jobs` should be a positive integer!'
+    limits = limits_from_args(args)
+    log.info(f'Limits per test: {limits}')
+    cache_from_args(args)
+
     log.info('collect_datasets')
     datasets = collect_datasets()
+    dsnames = [name for name, _ in datasets]
+
+    # author answers are kept on disk, wrong solutions are checked against them without solving tests again
+    with TemporaryDirectory(prefix='answers-') as answers:
+        peak = validate_author_solution(datasets, limits, Path(answers))
+        validate_wrong_solutions(dsnames, Path(answers), limits, peak, args.jobs, args.threads)
 
-    # datasets is readable
-    readed_ds = list(reading_datasets(datasets))
-    log.info('datasets is readable')
 
-    # datasets is solvable
-    solved_ds = list(solving_datasets(readed_ds))
-    log.info('datasets is solvable')
+def validate_author_solution(datasets, limits, answers: Path):
+    """
+    :param answers: dir to write answers into, one file per test
+    :return: Peak of the author solution
+    """
 
-    # solutions is readable
-    readed_sl = list(reading_solutions(solved_ds))
-    log.info('solutions is readable')
+    # every test goes through the whole pipeline before the next one is generated
+    verdict = Verdict()
+    peak = Peak()
+    total = 0
+    for full_name, input_data, hint, sl, output_data in solved_datasets(datasets, limits, peak):
+        total += 1
+        write_answer(answers, total, sl)
+        stripped_data = read_solution(full_name, sl, hint, stripping=True)
+        verdict.check(full_name, input_data, output_data, stripped_data)
 
-    readed_stripped_sl = list(reading_solutions(solved_ds, stripping=True))
-    log.info('stripped solutions is readable')
+    log.info(f'datasets is readable and solvable, solutions is readable ({total} tests)')
+    peak.report('Author solution')
 
     # solutions passing check
-    assert_solutions(readed_ds, readed_sl, readed_stripped_sl)
+    assert_solutions(verdict)
     log.info('solutions passing check')
 
+    return peak
+
+
+def validate_wrong_solutions(dsnames, answers: Path, limits, peak, jobs=1, threads=False):
     log.info('collect wrong solutions')
     wrsols = collect_wrong_solutions()
+    wrnames = [name for name, _ in wrsols]
 
-    # datasets is wrong_solvable
-    wrsolved_ds = list(wrong_solving_datasets(readed_ds, wrsols))
-    log.info('datasets is wrong_solvable')
-
-    # wrong solutions is readable
-    readed_wrsl = list(wrong_reading_solutions(wrsolved_ds))
-    log.info('wrong solutions is readable')
+    # slow solutions have to exceed time limit, while author solution stays well inside it
+    slow_limits = limits
+    if any(getattr(wrcall, 'is_slow', False) for _, wrcall in wrsols):
+        if slow_limits.timeout() is None:
+            slow_limits = Limits(wall=SLOW_TIME_LIMIT, memory=limits.memory)
+        assert_slow_margin(peak, slow_limits)
+    wrlimits = [slow_limits if getattr(wrcall, 'is_slow', False) else limits for _, wrcall in wrsols]
 
     # wrong solutions fail at least one check (but also should pass at least one)
-    assert_wrong_solutions(readed_ds, readed_sl, readed_wrsl)
+    validate = partial(validate_wrong_solution, dsnames, answers)
+    if jobs == 1:
+        assert_wrong_solutions(wrnames, map(validate, wrnames, wrlimits))
+    else:
+        with create_executor(jobs, threads) as pool:
+            assert_wrong_solutions(wrnames, pool.map(validate, wrnames, wrlimits))
     log.info('wrong solutions give representative feedback')
 
 
-def assert_wrong_solutions(readed_ds, readed_sl, readed_wrsl):
-    for wrname, wrans in readed_wrsl:
-        try:
-            assert_solutions(readed_ds, readed_sl, wrans)
-        except PartiallyCorrectException:
-            # expect exception from checking
-            pass
-        except AbsolutelyWrongException:
-            # shit, this wrong solution is absolute garbage
-            raise ValidationException(f'Wrong solution "{wrname}" did not pass any test, but should.')
-        except Exception as e:
-            # something goes wrong
-            raise ValidationException(f'Wrong solution "{wrname}" goes bad with check.') from e
+def write_answer(answers: Path, testno, sl):
+    (answers / f'{testno}.out').write_bytes(sl.encode('utf-8'))
+
+
+def read_answer(answers: Path, testno):
+    return (answers / f'{testno}.out').read_bytes().decode('utf-8')
+
+
+def assert_wrong_solutions(wrnames, failures):
+    """
+    Raise the first failure in `FAILURES_ORDER`, wrong solutions failing the same way are taken in order
+    :param failures: `failure_of` result (or None) for each wrong solution
+    """
+
+    first = None
+    for wrname, failure in zip(wrnames, failures):
+        if failure is None:
+            log.debug(f'Wrong solution "{wrname}" gives representative feedback')
+        elif first is None or failure[0] < first[0]:
+            first = failure
+
+    if first is not None:
+        # rebuild exceptions chain, workers cannot send it with causes
+        exc = None
+        for msg in reversed(first[1]):
+            exc = chained(ValidationException(msg), exc)
+        raise exc
+
+
+def failure_of(e):
+    """
+    :return: (index of exception class in `FAILURES_ORDER`, messages of exceptions chain)
+    """
+
+    order = next(i for i, cls in enumerate(FAILURES_ORDER) if isinstance(e, cls))
+    messages = []
+    cause = e
+    while cause:
+        messages.append(str(cause))
+        cause = cause.__cause__
+    return order, messages
+
+
+def assert_slow_margin(peak, slow_limits):
+    timeout = slow_limits.timeout()
+    margin = timeout / peak.time if peak.time else float('inf')
+    log.info(f'Time limit for slow solutions: {timeout}s, author peak time: {peak.time:.3f}s (margin x{margin:.1f})')
+    if margin < SLOW_MARGIN:
+        raise ValidationException(f'Author solution peak time {peak.time:.3f}s at {peak.time_name} is not '
+                                  f'{SLOW_MARGIN} times below time limit {timeout}s for slow solutions.')
+
+
+def validate_wrong_solution(dsnames, answers, wrname, limits):
+    """
+    Check one wrong solution, stop as soon as it passed one test and failed another one
+    (or, for a slow one, as soon as it exceeded time limit).
+    Arguments are names and paths, so the call is picklable for worker processes.
+    :param answers: dir with answers of the author solution written by `write_answer`
+    :return: None if wrong solution is fine, otherwise `failure_of` its exception
+    """
+
+    try:
+        if getattr(getattr(wrongs, wrname), 'is_slow', False):
+            assert_slow_solution(dsnames, limits, wrname)
         else:
-            # shit, we didnt catch wrong solution
-            raise ValidationException(f'Wrong solution "{wrname}" passed all tests, but should fail at least one.')
+            assert_wrong_solution(dsnames, answers, limits, wrname)
+    except Exception as e:
+        return failure_of(e)
+
 
+def assert_wrong_solution(dsnames, answers, limits, wrname):
+    datasets = [(name, find_dataset(name)) for name in dsnames]
+    wrcall = getattr(wrongs, wrname)
 
-def wrong_reading_solutions(wrsolved_ds):
-    for wrname, wrsols in wrsolved_ds:
+    wrverdict = Verdict()
+    for testno, (full_name, input_data, hint) in enumerate(reading_datasets(datasets), start=1):
+        # only the wrong solution runs, the author one has been solved in the main process
+        output_data = read_solution(full_name, read_answer(answers, testno), hint)
         try:
-            yield wrname, list(reading_solutions(wrsols))
+            wrsl = solve_dataset(full_name, input_data, wrcall, limits)
         except Exception as e:
-            raise ValidationException(f'Failed to read wrong solution "{wrname}"') from e
-
-
-def wrong_solving_datasets(readed_ds, wrsols):
-    for wrname, wrcall in wrsols:
+            raise WrongRunException(f'Failed to run wrong solution "{wrname}"') from e
         try:
-            yield wrname, list(solving_datasets(readed_ds, wrcall))
+            wrdata = read_solution(full_name, wrsl, hint)
         except Exception as e:
-            raise ValidationException(f'Failed to run wrong solution "{wrname}"') from e
+            raise WrongReadException(f'Failed to read wrong solution "{wrname}"') from e
 
+        wrverdict.check(full_name, input_data, output_data, wrdata)
+        if wrverdict.correct and wrverdict.wrong:
+            # verdict cannot change anymore
+            return
 
-def assert_solutions(readed_ds, readed_sl, answered_sl=None):
-    if answered_sl is None:
-        answered_sl = readed_sl
+    try:
+        assert_solutions(wrverdict)
+    except PartiallyCorrectException:
+        # expect exception from checking
+        pass
+    except AbsolutelyWrongException:
+        # shit, this wrong solution is absolute garbage
+        raise ValidationException(f'Wrong solution "{wrname}" did not pass any test, but should.')
+    except Exception as e:
+        # something goes wrong
+        raise ValidationException(f'Wrong solution "{wrname}" goes bad with check.') from e
+    else:
+        # shit, we didnt catch wrong solution
+        raise ValidationException(f'Wrong solution "{wrname}" passed all tests, but should fail at least one.')
 
-    correct = 0
-    wrong = 0
-    first_error = None
-    first_full_name = ''
 
-    for (full_name1, indata, _), (full_name2, outdata), (full_name3, ansdata) in zip(readed_ds, readed_sl, answered_sl):
-        assert full_name1 == full_name2, f'Checking solutions on different names'
-        assert full_name1 == full_name3, f'Checking solutions on different names'
-        try:
-            check(indata, outdata, ansdata)
-            correct += 1
-        except Exception as e:
-            wrong += 1
-            if first_error is None:
-                first_error = e
-                first_full_name = full_name1
+def assert_slow_solution(dsnames, limits, wrname):
+    datasets = [(name, find_dataset(name)) for name in dsnames]
+    wrcall = getattr(wrongs, wrname)
 
-    if not correct:
-        raise AbsolutelyWrongException(f'Failed to check solution {first_full_name}') from first_error
-    elif wrong:
-        raise PartiallyCorrectException(f'Failed to check solution {first_full_name}') from first_error
+    for full_name, input_data, _ in reading_datasets(datasets):
+        run = call_limited(wrcall, input_data, limits)
+        if run.verdict == TLE:
+            log.info(f'Slow solution "{wrname}" exceeded time limit at {full_name}')
+            return
+        if run.verdict != OK:
+            failure = chained(ValidationException(f'Failed to solve dataset {full_name}'), LimitException(run))
+            raise WrongRunException(f'Failed to run wrong solution "{wrname}"') from failure
 
+    raise ValidationException(f'Slow solution "{wrname}" did not exceed time limit {limits.timeout()}s on any test, '
+                              f'but should.')
 
-def reading_solutions(solved_ds, stripping=False):
-    for full_name, sl, hint in solved_ds:
-        try:
-            sl = sl.strip(' ') if stripping else sl
-            with stdio(input=sl):
-                output_data = call_with_args(output_reader, hint)
-            yield full_name, output_data
-        except Exception as e:
-            raise ValidationException(f'Failed to read solution {full_name}') from e
 
+def chained(exc, cause):
+    exc.__cause__ = cause
+    return exc
 
-def solving_datasets(readed_ds, solve_func=solve):
-    for full_name, ds_data, hint in readed_ds:
-        try:
-            with stdio(output=True) as cm:
-                call_with_args(solve_func, ds_data)
-            r = cm.output_get()
-            assert r == r.strip(' '), f'Solution of {full_name} did not pass stripping test'
-            yield full_name, cm.output_get(), hint
-        except Exception as e:
-            raise ValidationException(f'Failed to solve dataset {full_name}') from e
+
+def assert_solutions(verdict: Verdict):
+    if not verdict.correct:
+        raise AbsolutelyWrongException(f'Failed to check solution {verdict.first_full_name}') from verdict.first_error
+    elif verdict.wrong:
+        raise PartiallyCorrectException(f'Failed to check solution {verdict.first_full_name}') from verdict.first_error
+
+
+def solved_datasets(datasets, limits=NO_LIMITS, peak=None):
+    for full_name, input_data, hint in reading_datasets(datasets):
+        sl = solve_dataset(full_name, input_data, limits=limits, peak=peak)
+        yield full_name, input_data, hint, sl, read_solution(full_name, sl, hint)
+
+
+def read_solution(full_name, sl, hint, stripping=False):
+    try:
+        sl = sl.strip(' ') if stripping else sl
+        with stdio(input=sl, binary=is_binary(output_reader)):
+            return call_with_args(output_reader, hint)
+    except Exception as e:
+        raise ValidationException(f'Failed to read solution {full_name}') from e
+
+
+def solve_dataset(full_name, ds_data, solve_func=solve, limits=NO_LIMITS, peak=None):
+    try:
+        run = call_limited(solve_func, ds_data, limits)
+        if peak is not None:
+            peak.update(full_name, run)
+        if run.verdict != OK:
+            raise LimitException(run)
+        r = run.output
+        assert r == r.strip(' '), f'Solution of {full_name} did not pass stripping test'
+        return r
+    except Exception as e:
+        raise ValidationException(f'Failed to solve dataset {full_name}') from e
 
 
 def reading_datasets(datasets):
@@ -150,12 +320,14 @@ def reading_datasets(datasets):
         for dsno, ds in enumerate(dsgen(), start=1):
             full_name = f'"{name}" #{dsno}'
             try:
-                with stdio(input=ds):
-                    input_data = input_reader()
-                hint = call_with_args(get_hint, input_data)
-                yield full_name, input_data, hint
+                input_data, hint = read_input(ds)
             except Exception as e:
                 raise ValidationException(f'Failed to read dataset {full_name}') from e
+            finally:
+                # spilled tests are files
+                if hasattr(ds, 'close'):
+                    ds.close()
+            yield full_name, input_data, hint
 
 
 if __name__ == '__main__':
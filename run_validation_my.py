@@ -1,32 +1,39 @@
 import logging as log
 import sys
 
+from extra.cache import read_input
 from extra.introspection import collect_datasets
-from implementation.solver import solver, input_reader
+from implementation.solver import solver
+import my
 from my import generate, check, solve
+from pre_definition.clue import unbake_tests
 from pre_definition.solve_caller import call_with_args
-from pre_definition.stdio import stdio
+from pre_definition.stdio import stdio, to_text
+from pre_definition.tag import is_binary
 
 
 def main():
     log.info(f'--- Started: {sys.argv[0]} ---')
     log.info('check datasets')
-    datasets = collect_datasets()
+    # tests are generated again, neither pre-baked nor cached ones are trusted
+    datasets = collect_datasets(cache=False)
     dss = []
     for _, f in datasets:
-        dss += list(f())
+        # spilled tests are read and closed one by one
+        dss += map(to_text, f())
 
     gdss = generate()
     assert dss == list(map(lambda x: x[0], gdss)), 'Produced different datasets!'
 
     log.info('checker validation')
+    live = []
     for ds, clue in gdss:
-        with stdio(input=ds):
-            input_data = input_reader()
-        with stdio(output=True) as cm:
+        input_data, _ = read_input(ds)
+        with stdio(output=True, binary=is_binary(solver)) as cm:
             call_with_args(solver, input_data)
         reply = solve(ds)
-        assert reply == cm.output_get(), 'Produced different solutions!'
+        assert reply == to_text(cm.output_get()), 'Produced different solutions!'
+        live.append((ds, reply))
 
         res = check(reply, clue)
         if isinstance(res, bool):
@@ -34,6 +41,12 @@ def main():
         else:
             assert res[0], f'Failed check correct solution cause "{res[1]}"'
 
+    # tree shaking drops pre-baked tests from my.py generating them on the platform
+    prebaked = getattr(my, 'PREBAKED_TESTS', None)
+    if prebaked is not None:
+        log.info('pre-baked tests validation')
+        assert unbake_tests(prebaked) == live, 'Pre-baked tests differ from regenerated ones!'
+
 
 if __name__ == '__main__':
     log.basicConfig(level=log.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
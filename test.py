@@ -1,11 +1,34 @@
+import ast
+import asyncio
+import json
+import math
+import os
 import re
 import sys
-from io import StringIO
+import threading
+from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from pathlib import Path
+from random import Random
 
 import pytest
 
+import extra.cache as cache
+import extra.sources as sources
+import extra.limits as limits
+import pre_definition.clue as clue
 import pre_definition.params as params
 import pre_definition.stdio as stdio
+import pre_definition.tag as tag
+import run_benchmark as benchmark
+import run_build_dataset as build
+import run_compilation as compilation
+import run_pipeline as pipeline
+import run_validation as validation
+from extra.helper import create_executor
 
 
 @pytest.mark.parametrize(
@@ -100,7 +123,8 @@ def test_is_collection():
     [([('a', [1])], [(['a'], [1])]),
      ([('a, b', [(1, 2)])], [(['a', 'b'], [(1, 2)])]),
      ([('a', [1]), ('b', [2])], [(['a'], [1]), (['b'], [2])]),
-     ([('a', range(2)), ('b', [2])], [(['a'], [0, 1]), (['b'], [2])]),
+     ([('a', range(2)), ('b', [2])], [(['a'], range(2)), (['b'], [2])]),
+     ([('a', (x for x in range(2))), ('b', {2})], [(['a'], [0, 1]), (['b'], [2])]),
      ]
 )
 def test_parse_params(data, expected):
@@ -296,6 +320,135 @@ def test_stdio_stdin_exception_recover():
         assert sys.stdin is curr
 
 
+def test_stdio_binary_stdout():
+    curr = sys.stdout
+    with stdio.stdio(output=True, binary=True) as cm:
+        print(1, 2, 3)
+        sys.stdout.buffer.write(b'4 5 6\n')
+        print('é')
+    assert cm.output_get() == '1 2 3\n4 5 6\né\n'.encode('utf-8')
+    assert sys.stdout is curr
+
+
+def test_stdio_binary_stdout_file():
+    sb = BytesIO()
+    with stdio.stdio(output=sb, binary=True):
+        print(1, 2, 3)
+    assert sb.getvalue() == b'1 2 3\n'
+    assert not sb.closed
+
+
+@pytest.mark.parametrize('data', ['1 2\n3\n', b'1 2\n3\n'])
+def test_stdio_binary_stdin(data):
+    curr = sys.stdin
+    with stdio.stdio(input=data, binary=True):
+        assert input() == '1 2'
+        assert input() == '3'
+    with stdio.stdio(input=data, binary=True):
+        assert sys.stdin.buffer.read() == b'1 2\n3\n'
+    assert sys.stdin is curr
+
+
+def test_stdio_binary_stdin_buffered():
+    with stdio.stdio(input=True, binary=True) as cm:
+        cm.input_write('1 2 3\n')
+        assert input() == '1 2 3'
+
+
+def test_stdio_text_stdin_bytes():
+    with stdio.stdio(input=b'1 2 3\n'):
+        assert input() == '1 2 3'
+    sb = BytesIO(b'4 5 6\n')
+    with stdio.stdio(input=sb):
+        assert input() == '4 5 6'
+    assert not sb.closed
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_tokens(binary):
+    with stdio.stdio(input='3\n1 2  3\nabc\n', binary=binary):
+        tokens = stdio.Tokens()
+        n = tokens.next_int()
+        assert tokens.next_ints(n) == [1, 2, 3]
+        assert tokens.next_str() == 'abc'
+        assert list(tokens) == []
+
+
+@contextmanager
+def context_stdio():
+    # installed inside a test, pytest replaces standard streams between test phases
+    stdio.install_context_stdio()
+    try:
+        yield
+    finally:
+        stdio.uninstall_context_stdio()
+
+
+def test_context_stdio_install():
+    curr = sys.stdout
+    with context_stdio():
+        proxy = sys.stdout
+        assert stdio.is_context_stdio()
+        stdio.install_context_stdio()
+        assert sys.stdout is proxy
+    assert sys.stdout is curr
+    assert not stdio.is_context_stdio()
+
+
+def test_context_stdio_forked():
+    # a forked child redirects by swapping `sys` streams
+    with context_stdio():
+        run = limits.call_limited(lambda a: print(a), [7], limits.Limits(wall=5))
+        assert stdio.is_context_stdio()
+    assert run.output == '7\n'
+
+
+def test_context_stdio_reenter():
+    sb = StringIO()
+    with context_stdio():
+        curr = sys.stdout
+        with stdio.stdio(output=sb, input='1 2 3'):
+            print(1, 2, 3)
+            with stdio.stdio(output=True) as cm:
+                print(input())
+            print(7, 8, 9)
+        assert sys.stdout is curr
+    assert cm.output_get() == '1 2 3\n'
+    assert sb.getvalue() == '1 2 3\n7 8 9\n'
+
+
+def test_context_stdio_threads():
+    barrier = threading.Barrier(8)
+
+    def worker(k):
+        with stdio.stdio(input=f'{k}\n', output=True) as cm:
+            barrier.wait()
+            x = int(input())
+            for _ in range(100):
+                print(x)
+        return cm.output_get()
+
+    with context_stdio(), ThreadPoolExecutor(8) as pool:
+        r = list(pool.map(worker, range(8)))
+    assert r == [f'{k}\n' * 100 for k in range(8)]
+
+
+def test_context_stdio_asyncio():
+    async def worker(k):
+        with stdio.stdio(output=True) as cm:
+            for _ in range(10):
+                print(k)
+                await asyncio.sleep(0)
+        return cm.output_get()
+
+    async def run_all():
+        return await asyncio.gather(*(worker(k) for k in range(4)))
+
+    with context_stdio():
+        r = asyncio.run(run_all())
+    assert r == [f'{k}\n' * 10 for k in range(4)]
+
+
 def test_merge_dicts():
     d1 = {1: 2}
     d2 = {2: 3}
@@ -410,6 +563,136 @@ def test_convert_params():
     assert_have_same_items(list(params.convert_params([a, bc, d])), r)
 
 
+def test_params_product():
+    ps = params.ParamsProduct([(['a'], [0, 1, 2]), (['b', 'c'], [(1, 2), (3, 4)]), (['d'], ['x'])])
+    assert len(ps) == 6
+    assert [ps[i] for i in range(len(ps))] == list(ps)
+    assert ps[3] == {'a': 1, 'b': 3, 'c': 4, 'd': 'x'}
+
+    with pytest.raises(IndexError):
+        _ = ps[6]
+
+
+def test_params_gen_n_huge_product():
+    ps = [('a', list(range(10 ** 4))), ('b', list(range(10 ** 4))), ('c', list(range(10 ** 4)))]
+    f = params.params(ps, n=5)(lambda a, b, c: print(a, b, c))
+    r = list(f())
+    assert len(set(r)) == 5
+    assert r == list(f())
+
+
+def test_params_range_is_virtual():
+    big = range(10 ** 30)
+    ps = params.convert_params([('a', big), ('b, c', ((1, 2), (3, 4)))])
+    assert ps.params[0][1] is big
+    assert len(ps.params[1][1]) == 2
+    assert ps.size == 2 * 10 ** 30
+    assert ps[ps.size - 1] == {'a': 10 ** 30 - 1, 'b': 3, 'c': 4}
+    assert next(iter(ps)) == {'a': 0, 'b': 1, 'c': 2}
+
+
+@pytest.mark.parametrize(
+    'r',
+    [range(0), range(5), range(2, 11, 3), range(10, 0, -3), range(5, 1)]
+)
+def test_axis_len(r):
+    assert params.axis_len(r) == len(r)
+
+
+def test_params_gen_sample_stream():
+    ps = [('a', (x for x in range(1000))), ('b', [1, 2])]
+    f = params.params(ps, sample=0.1, seed=1, stream=True)(lambda a, b: print(a * 10 + b))
+    r = list(f())
+    assert 100 < len(r) < 300
+    assert r == sorted(r, key=int)
+
+
+def test_params_gen_sample_stream_deterministic():
+    class Reiterable:
+        def __iter__(self):
+            return iter(range(100))
+
+    f = params.params([('a', Reiterable())], sample=0.5, seed=7, stream=True)(lambda a: print(a))
+    assert list(f()) == list(f())
+
+
+def test_params_gen_sample_stream_one_shot():
+    f = params.params([('a', iter(range(100))), ('b', iter([1, 2]))], sample=0.5, stream=True)(lambda a, b: print(a, b))
+    assert list(f()) == list(f())
+
+
+def test_params_gen_sample_one_shot_twice():
+    f = params.params([('n', (x for x in range(100)))], sample=0.1)(lambda n: print(n))
+    r = list(f())
+    assert len(r) == 10
+    assert list(f()) == r
+
+
+def test_params_stream_without_sample():
+    m = 'Streaming works only with `sample`, but sample=<object SENTINEL>(SENTINEL)!'
+    with pytest.raises(AssertionError, match=re.escape(m)):
+        params.params([('a', iter(range(10)))], stream=True)
+
+
+def test_params_gen_sample_stream_at_least_one():
+    f = params.params([('a', iter(range(10)))], sample=0.0, stream=True)(lambda a: print(a))
+    assert list(f()) == ['9\n']
+
+
+def test_params_gen_sample_stream_assert_tuple_size():
+    m = 'Second part of tuple in `params[1]` should be a collection of tuples size 2 or dict with exact keys!'
+    ps = [('a', [1]), ('b,c', iter([(1, 2), (3,)]))]
+    f = params.params(ps, sample=1.0, stream=True)(lambda a, b, c: print(a, b, c))
+    with pytest.raises(AssertionError, match=re.escape(m)):
+        list(f())
+
+
+def test_sample_indexes_above_maxsize():
+    size = sys.maxsize * 4
+    r = params.sample_indexes(Random(1), size, 10)
+    assert len(set(r)) == 10
+    assert all(0 <= i < size for i in r)
+    assert r == params.sample_indexes(Random(1), size, 10)
+
+
+def ds2str_reference(ds):
+    return '\n'.join(' '.join(map(str, x)) for x in ds) + '\n'
+
+
+@pytest.mark.parametrize('ds', [
+    [],
+    [[]],
+    [[1]],
+    [[1, 2, 3], [4, 5], [], [6]],
+    [(True, None, 'ab'), [1.5, -2, b'x']],
+    (range(n) for n in range(5)),
+    [array('q', [1, -2, 3]), array('d', [0.1, 2.5]), array('f', [0.1])],
+])
+def test_ds2str(ds):
+    ds = list(ds)
+    assert params.ds2str(ds) == ds2str_reference(ds)
+
+
+def test_ds2str_file(monkeypatch):
+    monkeypatch.setattr(params, 'DS2STR_CHUNK', 2)
+    for n in range(6):
+        ds = [[i, i + 1] for i in range(n)]
+        f = StringIO()
+        assert params.ds2str(ds, f) is None
+        assert f.getvalue() == ds2str_reference(ds)
+
+
+def test_ds2str_numpy():
+    np = pytest.importorskip('numpy')
+    ds = np.arange(-6, 6, dtype=np.int64).reshape(3, 4)
+    assert params.ds2str(ds) == ds2str_reference(ds)
+    assert params.ds2str(list(ds)) == ds2str_reference(ds)
+    ds = np.array([[True, False], [False, True]])
+    assert params.ds2str(ds) == ds2str_reference(ds)
+    ds = np.linspace(0, 1, 6).reshape(2, 3)
+    assert params.ds2str(ds) == ds2str_reference(ds)
+
+
 def test_call_printer():
     def foo(a, b, c):
         print(a, b, c)
@@ -430,6 +713,58 @@ def test_call_printer_with_side_effect():
     assert side_effect.getvalue() == 'side effect\n'
 
 
+def test_call_printer_binary():
+    def foo(a, b, c):
+        print(a, b, c)
+        sys.stdout.buffer.write(b'4 5 6\n')
+
+    r = params.call_printer(foo, dict(a=1, b=2, c=3), binary=True)
+    assert r == b'1 2 3\n4 5 6\n'
+
+
+def test_call_printer_spill():
+    def foo(a):
+        print(a)
+
+    r = params.call_printer(foo, dict(a=12), spill=3)
+    assert r == b'12\n'
+
+    r = params.call_printer(foo, dict(a=123), spill=3)
+    assert r.read() == b'123\n'
+    r.close()
+
+    # exactly `spill` bytes stay in memory
+    r = params.call_printer(foo, dict(a=123), spill=4)
+    assert r == b'123\n'
+
+
+def test_call_printer_spill_closed_on_error():
+    spools = []
+
+    def foo():
+        spools.append(sys.stdout.buffer)
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError, match='boom'):
+        params.call_printer(foo, spill=3)
+    assert spools[0].closed
+
+
+def test_to_text_closes_file():
+    f = BytesIO('é\n'.encode('utf-8'))
+    assert stdio.to_text(f) == 'é\n'
+    assert f.closed
+
+
+def test_params_gen_spill():
+    ps = [('a', [1, 10 ** 20, 2])]
+    r = list(params.params(ps, spill=10)(lambda a: print(a))())
+    assert r[0] == b'1\n'
+    with r[1]:
+        assert r[1].read() == b'100000000000000000000\n'
+    assert r[2] == b'2\n'
+
+
 def test_call_printer_assert():
     def foo():
         assert False
@@ -460,7 +795,7 @@ def test_gen_all():
 
 def test_gen_n():
     ps = [{'a': 1, 'b': 2}, {'a': 2, 'b': 3}, {'a': 3, 'b': 4}, {'a': 4, 'b': 5}, {'a': 5, 'b': 6}]
-    r = to_strendl([20, 6, 12])
+    r = to_strendl([2, 30, 12])
     assert list(params.gen_n(ps, n=3, seed=42)(lambda a, b: print(a * b))()) == r
 
 
@@ -469,11 +804,11 @@ def test_gen_sample():
     _12 = {'a': 3, 'b': 4}
 
     ps = [{'a': 1, 'b': 2}, _6, _12, {'a': 4, 'b': 5}, {'a': 5, 'b': 6}]
-    r = to_strendl([20, 6, 12])
+    r = to_strendl([2, 30, 12])
     assert list(params.gen_sample(ps, sample=0.6, seed=42)(lambda a, b: print(a * b))()) == r
 
     ps = [{'a': 1, 'b': 2}, _12, _6, {'a': 4, 'b': 5}, {'a': 5, 'b': 6}]
-    r = to_strendl([20, 12, 6])
+    r = to_strendl([2, 30, 6])
     assert list(params.gen_sample(ps, sample=0.6, seed=42)(lambda a, b: print(a * b))()) == r
 
 
@@ -521,9 +856,16 @@ def test_params_gen_all():
     assert list(params.params(ps)(lambda a, b: print(a * b))()) == r
 
 
+def test_params_gen_all_twice():
+    ps = [('a', range(3)), ('b', [1, 2])]
+    f = params.params(ps)(lambda a, b: print(a * b))
+    assert list(f()) == list(f())
+    assert len(list(f())) == 6
+
+
 def test_params_gen_n():
     ps = [('a,b', [(1, 2), (2, 3), (3, 4), (4, 5), (5, 6)])]
-    r = to_strendl([20, 6, 12])
+    r = to_strendl([2, 30, 12])
     assert list(params.params(ps, n=3)(lambda a, b: print(a * b))()) == r
 
 
@@ -532,15 +874,911 @@ def test_params_gen_sample():
     _12 = (3, 4)
 
     ps = [('a,b', [(1, 2), _6, _12, (4, 5), (5, 6)])]
-    r = to_strendl([20, 6, 12])
+    r = to_strendl([2, 30, 12])
     assert list(params.params(ps, sample=0.6)(lambda a, b: print(a * b))()) == r
 
     ps = [('a,b', [(1, 2), _12, _6, (4, 5), (5, 6)])]
-    r = to_strendl([20, 12, 6])
+    r = to_strendl([2, 30, 6])
     assert list(params.params(ps, sample=0.6)(lambda a, b: print(a * b))()) == r
 
 
+def test_params_gen_binary():
+    ps = [('a', range(1, 4)), ('b', range(100, 200))]
+    f = lambda a, b: print(a, b)
+    text = list(params.params(ps, n=5)(f)())
+    assert list(params.params(ps, n=5, binary=True)(f)()) == [x.encode('utf-8') for x in text]
+
+
 def test_params_is_dataset():
     ps = [('a,b', [(1, 2)])]
     f = params.params(ps)(lambda a, b: a * b)
     assert hasattr(f, 'is_dataset')
+
+
+def test_params_origins():
+    ps = [('a', range(3))]
+    g = lambda a: print(a)
+    f = params.params(ps)(g)
+    assert f.generator is g
+    assert f.params is ps
+
+
+def test_binary():
+    f = tag.binary(lambda n: print(n))
+    assert tag.is_binary(f)
+    assert not tag.is_binary(lambda n: print(n))
+
+
+def test_wrong():
+    f = tag.wrong(lambda n: print(n))
+    assert f.is_wrong
+    assert not f.is_slow
+
+
+def test_wrong_slow():
+    f = tag.wrong(slow=True)(lambda n: print(n))
+    assert f.is_wrong
+    assert f.is_slow
+
+
+def test_call_limited_unbounded():
+    run = limits.call_limited(lambda a, b: print(a + b), (1, 2))
+    assert run.verdict == limits.OK
+    assert run.output == '3\n'
+    assert run.memory is None
+
+
+def test_call_limited_binary():
+    run = limits.call_limited(tag.binary(lambda a: sys.stdout.buffer.write(b'%d\n' % a)), [7])
+    assert run.output == '7\n'
+
+
+def test_call_limited_ok():
+    run = limits.call_limited(lambda a: print(a), [7], limits.Limits(wall=5))
+    assert run.verdict == limits.OK
+    assert run.output == '7\n'
+    # memory allocated by the call only, printing allocates next to nothing
+    assert run.memory is not None
+
+
+def allocate(n):
+    data = b'x' * n
+    print(len(data))
+
+
+def test_call_limited_memory_of_call():
+    # the forked child starts with memory of the parent, it is not counted
+    held = b'x' * (128 * limits.MB)
+    run = limits.call_limited(allocate, 1, limits.Limits(memory=64 * limits.MB))
+    assert run.verdict == limits.OK
+    assert run.memory < 16 * limits.MB
+
+    run = limits.call_limited(allocate, 32 * limits.MB, limits.Limits(memory=64 * limits.MB))
+    assert run.verdict == limits.OK
+    assert 32 * limits.MB <= run.memory < 48 * limits.MB
+
+    run = limits.call_limited(allocate, 96 * limits.MB, limits.Limits(memory=64 * limits.MB))
+    assert run.verdict == limits.MLE
+    assert len(held) == 128 * limits.MB
+
+
+def test_call_limited_tle():
+    def hang():
+        while True:
+            pass
+
+    run = limits.call_limited(hang, [], limits.Limits(wall=0.2))
+    assert run.verdict == limits.TLE
+    assert run.output is None
+
+
+def test_call_limited_re():
+    def fail():
+        raise ValueError('boom')
+
+    run = limits.call_limited(fail, [], limits.Limits(wall=5))
+    assert run.verdict == limits.RE
+    assert run.error == 'ValueError: boom'
+
+
+@pytest.mark.parametrize('packing', [clue.PLAIN, clue.ZLIB, clue.LZMA])
+def test_clue_roundtrip(packing):
+    instr, expstr = '3\n1 2 3\n' * 100, 'é 6\n'
+    packed = clue.pack_clue(instr, expstr, packing)
+    assert clue.unpack_clue(packed) == (packing, instr, expstr)
+
+
+def test_clue_compressed():
+    instr, expstr = '1 2 3\n' * 1000, '6\n' * 1000
+    _, cin, cexp = clue.pack_clue(instr, expstr, clue.ZLIB)
+    assert len(cin) < len(instr) // 10
+    assert len(cexp) < len(expstr) // 10
+
+
+def test_clue_digest():
+    digest = clue.digest_of([1, 2, 3])
+    packed = clue.pack_clue('3\n', digest, clue.DIGEST)
+    assert clue.unpack_clue(packed) == (clue.DIGEST, '3\n', digest)
+    assert clue.digest_of([1, 2, 3]) == digest
+    assert clue.digest_of([1, 2, 4]) != digest
+
+
+@pytest.mark.parametrize('packing', [clue.ZLIB, clue.LZMA])
+def test_clue_tiny_stays_plain(packing):
+    assert clue.pack_clue('5\n', '13\n', packing) == ('5\n', '13\n')
+    assert clue.unpack_clue(clue.pack_clue('5\n', '13\n', packing)) == (clue.PLAIN, '5\n', '13\n')
+
+
+def test_clue_compressed_per_field():
+    instr, expstr = '1 2 3\n' * 1000, '6\n'
+    packed = clue.pack_clue(instr, expstr, clue.ZLIB)
+    assert packed[2] == clue.RAW_FIELD + expstr
+    assert clue.unpack_clue(packed) == (clue.ZLIB, instr, expstr)
+    assert len(json.dumps(packed)) < len(json.dumps((instr, expstr)))
+
+
+def test_clue_plain_is_pair():
+    assert clue.pack_clue('1\n', '2\n', clue.PLAIN) == ('1\n', '2\n')
+
+
+def test_bake_tests():
+    tests = [('1\n', '2\n'), ('é\n' * 100, '')]
+    blob = clue.bake_tests(tests)
+    assert isinstance(blob, str)
+    assert clue.unbake_tests(blob) == tests
+
+
+@pytest.fixture
+def template():
+    s = Path('extra/template.py.tpl').read_text()
+    s = s.replace('DATASETS_FUNCTIONS', '[]').replace('CLUE_PACKING', repr(clue.PLAIN))
+    s = s.replace('PREBAKED_BLOB', 'None').replace('SOLVED_TESTS', 'generated_tests')
+    namespace = {}
+    exec(compile(s, 'template.py', 'exec'), namespace)
+    return namespace
+
+
+def test_template_clue_objects_are_copies(template):
+    template['read_input'] = lambda instr: ([int(x) for x in instr.split()], {'n': 3})
+    template['read_output'] = lambda outstr, hint: [int(x) for x in outstr.split()]
+
+    packed = ['1 2 3\n', '6\n']
+    _, input_data, hint, expected = template['clue_objects'](packed)
+    input_data.append(4)
+    hint['n'] = 4
+    expected.clear()
+    assert template['clue_objects'](packed) == (clue.PLAIN, [1, 2, 3], {'n': 3}, [6])
+    assert template['prepare_clue'].cache_info().hits == 1
+
+
+def test_template_clue_cache_hits_every_pass(template):
+    clues = [[f'{n}\n', f'{n * 2}\n'] for n in range(100)]
+    template['read_output'] = lambda outstr, hint: int(outstr)
+    template['checker'] = lambda input_data, expected, result: None
+    for _ in range(2):
+        for packed in clues:
+            assert template['check'](packed[1], packed) is True
+    assert template['prepare_clue'].cache_info()[:2] == (100, 100)
+
+
+def test_template_clue_not_picklable(template):
+    template['read_input'] = lambda instr: ((int(x) for x in instr.split()), lambda: 3)
+    template['read_output'] = lambda outstr, hint: [int(x) for x in outstr.split()]
+    template['checker'] = lambda input_data, expected, result: None
+
+    packed = ['1 2 3\n', '6\n']
+    for _ in range(2):
+        packing, input_data, hint, expected = template['clue_objects'](packed)
+        assert (list(input_data), hint(), expected) == ([1, 2, 3], 3, [6])
+        assert template['check']('6\n', packed) is True
+
+
+def test_template_check(template):
+    assert template['check']('3\n', ['2\n', '3\n']) is True
+    assert template['check']('4\n', ['2\n', '3\n']) == (False, 'Wrong!')
+
+
+@pytest.fixture
+def dataset_cache(tmp_path, monkeypatch):
+    source = tmp_path / 'generator.py'
+    source.write_text('seed = 1\n')
+    monkeypatch.setattr(cache, 'DATASETS_DIR', tmp_path / 'datasets')
+    monkeypatch.setattr(cache, 'GENERATOR_MODULES', [source])
+    cache.sources_fingerprint.cache_clear()
+    yield source
+    cache.sources_fingerprint.cache_clear()
+
+
+def counting_dataset(tests):
+    calls = []
+
+    def dataset():
+        calls.append(1)
+        for data in tests:
+            yield BytesIO(data) if isinstance(data, bytearray) else data
+
+    return dataset, calls
+
+
+def test_cached_dataset(dataset_cache):
+    f, calls = counting_dataset(['1\n', b'\x00\x01', 'é\n'])
+    cached = cache.cached_dataset('ds', f)
+    assert cached.is_cached
+
+    assert list(cached()) == ['1\n', b'\x00\x01', 'é\n']
+    assert list(cached()) == ['1\n', b'\x00\x01', 'é\n']
+    assert len(calls) == 1
+
+
+def test_cached_dataset_spilled(dataset_cache):
+    f, calls = counting_dataset([bytearray(b'1 2\n')])
+    cached = cache.cached_dataset('ds', f)
+
+    for _ in range(2):
+        data, = cached()
+        with data:
+            assert data.read() == b'1 2\n'
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('cached_before', [False, True])
+def test_cached_dataset_spilled_opened_lazily(dataset_cache, cached_before):
+    f, _ = counting_dataset([bytearray(b'%d\n' % i) for i in range(10)])
+    cached = cache.cached_dataset('ds', f)
+    if cached_before:
+        for data in cached():
+            data.close()
+
+    tests = list(cached())
+    assert all(data.file is None for data in tests)
+    assert stdio.to_text(tests[3]) == '3\n'
+    assert tests[3].closed
+    with stdio.stdio(input=tests[5]):
+        assert input() == '5'
+    tests[5].close()
+    assert sum(data.file is not None for data in tests) == 2
+
+
+def test_cached_dataset_invalidated(dataset_cache):
+    f, calls = counting_dataset(['1\n'])
+    cached = cache.cached_dataset('ds', f)
+    list(cached())
+
+    dataset_cache.write_text('seed = 2\n')
+    cache.sources_fingerprint.cache_clear()
+    assert list(cached()) == ['1\n']
+    assert len(calls) == 2
+    assert len(list(cache.DATASETS_DIR.glob('ds-*'))) == 1
+
+
+def test_cached_dataset_invalidated_by_import(dataset_cache, monkeypatch):
+    root = dataset_cache.parent
+    helper = root / 'dshelper.py'
+    helper.write_text('seed = 1\n')
+    dataset_cache.write_text('import dshelper\n')
+    monkeypatch.chdir(root)
+    monkeypatch.syspath_prepend(str(root))
+    sources.find_module_spec.cache_clear()
+
+    f, calls = counting_dataset(['1\n'])
+    cached = cache.cached_dataset('ds', f)
+    list(cached())
+    list(cached())
+    assert len(calls) == 1
+
+    helper.write_text('seed = 2\n')
+    cache.sources_fingerprint.cache_clear()
+    list(cached())
+    assert len(calls) == 2
+    sources.find_module_spec.cache_clear()
+
+
+def test_cached_dataset_disabled(dataset_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'enabled', False)
+    f, calls = counting_dataset(['1\n'])
+    cached = cache.cached_dataset('ds', f)
+    assert list(cached()) == ['1\n']
+    assert list(cached()) == ['1\n']
+    assert len(calls) == 2
+    assert not cache.DATASETS_DIR.exists()
+
+
+@pytest.mark.parametrize('argv, enabled, cleared', [
+    ([], True, False),
+    (['--no-cache'], False, False),
+    (['--clear-cache'], True, True),
+])
+def test_cache_from_args(tmp_path, monkeypatch, argv, enabled, cleared):
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    monkeypatch.setattr(cache, 'enabled', True)
+    (cache.CACHE_DIR / 'datasets').mkdir(parents=True)
+
+    parser = ArgumentParser()
+    cache.add_cache_arguments(parser)
+    cache.cache_from_args(parser.parse_args(argv))
+    assert cache.enabled == enabled
+    assert cache.CACHE_DIR.exists() != cleared
+
+
+def test_cached_dataset_incomplete(dataset_cache):
+    f, calls = counting_dataset(['1\n', '2\n'])
+    cached = cache.cached_dataset('ds', f)
+
+    tests = cached()
+    assert next(tests) == '1\n'
+    tests.close()
+    assert list(cache.DATASETS_DIR.iterdir()) == []
+
+    assert list(cached()) == ['1\n', '2\n']
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def input_cache(tmp_path, monkeypatch):
+    source = tmp_path / 'solver.py'
+    source.write_text('version = 1\n')
+    monkeypatch.setattr(cache, 'INPUTS_DIR', tmp_path / 'inputs')
+    monkeypatch.setattr(cache, 'READER_MODULES', [source])
+    monkeypatch.setattr(cache, 'MIN_CACHED_INPUT', 0)
+    monkeypatch.setattr(cache, 'hinter', lambda *xs: sum(xs))
+    cache.sources_fingerprint.cache_clear()
+
+    calls = []
+
+    def reader():
+        calls.append(1)
+        return list(map(int, input().split()))
+
+    monkeypatch.setattr(cache, 'input_reader', reader)
+    yield source, calls
+    cache.sources_fingerprint.cache_clear()
+
+
+def test_read_input_cached(input_cache):
+    _, calls = input_cache
+    assert cache.read_input('1 2 3\n') == ([1, 2, 3], 6)
+
+    input_data, hint = cache.read_input(b'1 2 3\n')
+    assert (input_data, hint) == ([1, 2, 3], 6)
+    input_data.append(4)
+    assert cache.read_input(BytesIO(b'1 2 3\n')) == ([1, 2, 3], 6)
+    assert len(calls) == 1
+
+
+def test_read_input_invalidated(input_cache):
+    source, calls = input_cache
+    cache.read_input('1 2\n')
+    cache.read_input('3 4\n')
+
+    source.write_text('version = 2\n')
+    cache.sources_fingerprint.cache_clear()
+    assert cache.read_input('1 2\n') == ([1, 2], 3)
+    assert len(calls) == 3
+    assert len(list(cache.INPUTS_DIR.iterdir())) == 1
+
+
+def test_read_input_small_not_cached(input_cache, monkeypatch):
+    _, calls = input_cache
+    monkeypatch.setattr(cache, 'MIN_CACHED_INPUT', 5)
+    for data in ['1 2\n', b'1 2\n', BytesIO(b'1 2\n'), '1 2\n']:
+        assert cache.read_input(data) == ([1, 2], 3)
+    assert len(calls) == 4
+    assert not cache.INPUTS_DIR.exists()
+
+    for data in ['1 2 3\n', BytesIO(b'1 2 3\n'), '1 2 3\n']:
+        assert cache.read_input(data) == ([1, 2, 3], 6)
+    assert len(calls) == 5
+
+
+def test_prune_inputs(input_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_INPUTS_SIZE', 0)
+    cache.read_input('1 2\n')
+    inputdir, = cache.INPUTS_DIR.iterdir()
+    assert list(inputdir.iterdir()) == []
+
+    for i in range(3):
+        path = inputdir / f'{i}.pickle'
+        path.write_bytes(b'x' * 10)
+        os.utime(path, (i, i))
+    # the oldest one has been used last
+    cache.touch(inputdir / '0.pickle')
+    cache.prune_inputs(inputdir, max_size=25)
+    assert sorted(path.name for path in inputdir.iterdir()) == ['0.pickle', '2.pickle']
+    cache.prune_inputs(inputdir, max_size=10)
+    assert [path.name for path in inputdir.iterdir()] == ['0.pickle']
+
+
+def test_read_input_disabled(input_cache, monkeypatch):
+    _, calls = input_cache
+    monkeypatch.setattr(cache, 'enabled', False)
+    assert cache.read_input('1 2\n') == ([1, 2], 3)
+    assert cache.read_input('1 2\n') == ([1, 2], 3)
+    assert len(calls) == 2
+    assert not cache.INPUTS_DIR.exists()
+
+
+def test_read_input_unpicklable(input_cache, monkeypatch):
+    _, calls = input_cache
+    monkeypatch.setattr(cache, 'hinter', lambda *xs: (lambda: sum(xs)))
+    cache.read_input('1 2\n')
+    cache.read_input('1 2\n')
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    groups = {'a': ['1\n', '2\n', '3\n'], 'b': ['4\n']}
+    monkeypatch.setattr(build, 'find_dataset', lambda name: lambda: iter(groups[name]))
+
+    solved = []
+    solve_file = build.solve_file
+    monkeypatch.setattr(build, 'solve_file', lambda path, **kwargs: solved.append(path) or solve_file(path, **kwargs))
+
+    dsdir = tmp_path / 'dataset'
+    (dsdir / 'full').mkdir(parents=True)
+    return dsdir, groups, solved
+
+
+def rebuild(dsdir, groups, manifest=None):
+    manifest = build.build_datasets([(name, None) for name in groups], dsdir, 1, dsdir / 'full', manifest=manifest)
+    build.prune_dataset(dsdir, manifest)
+    return manifest
+
+
+def test_build_datasets(build_dir):
+    dsdir, groups, solved = build_dir
+    rebuild(dsdir, groups)
+
+    assert len(solved) == 4
+    assert (dsdir / 'full' / '4.in').read_text() == '4\n'
+    for no, test in enumerate(['1_a/1', '1_a/2', '1_a/3', '2_b/1'], start=1):
+        for suffix in ['.in', '.out']:
+            assert (dsdir / 'full' / f'{no}{suffix}').samefile(dsdir / f'{test}{suffix}')
+
+
+def test_build_datasets_spilled_mode(build_dir):
+    dsdir, groups, _ = build_dir
+    groups['a'] = [BytesIO(b'1\n'), '2\n']
+    rebuild(dsdir, groups)
+
+    spilled, plain = dsdir / '1_a' / '1.in', dsdir / '1_a' / '2.in'
+    assert spilled.read_text() == '1\n'
+    assert spilled.stat().st_mode == plain.stat().st_mode
+    assert (dsdir / 'full' / '1.in').samefile(spilled)
+    assert not list(dsdir.glob('.*.spill'))
+
+
+def test_build_datasets_incremental(build_dir):
+    dsdir, groups, solved = build_dir
+    manifest = rebuild(dsdir, groups)
+    solved.clear()
+
+    groups['a'] = ['1\n', '5\n']
+    rebuild(dsdir, groups, manifest)
+
+    assert solved == [dsdir / '1_a' / '2.in']
+    assert (dsdir / '1_a' / '2.in').read_text() == '5\n'
+    assert sorted(p.name for p in (dsdir / '1_a').iterdir()) == ['1.in', '1.out', '2.in', '2.out']
+    assert sorted(p.name for p in (dsdir / 'full').iterdir()) == ['1.in', '1.out', '2.in', '2.out', '3.in', '3.out']
+    assert (dsdir / 'full' / '3.out').samefile(dsdir / '2_b' / '1.out')
+    assert (dsdir / 'full' / '2.out').samefile(dsdir / '1_a' / '2.out')
+
+
+def test_build_datasets_solver_changed(build_dir, tmp_path, monkeypatch):
+    dsdir, groups, solved = build_dir
+    source = tmp_path / 'solver.py'
+    source.write_text('version = 1\n')
+    monkeypatch.setattr(build, 'SOLVER_MODULES', [source])
+
+    manifest = rebuild(dsdir, groups)
+    manifest = rebuild(dsdir, groups, manifest)
+    assert len(solved) == 4
+
+    source.write_text('version = 2\n')
+    rebuild(dsdir, groups, manifest)
+    assert len(solved) == 8
+
+
+def test_local_sources(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'srcpkg').mkdir()
+    (tmp_path / 'srcpkg' / 'util.py').write_text('import os\n')
+    (tmp_path / 'srcpkg' / 'data.py').write_text('def load():\n    from srcpkg.util import path\n')
+    (tmp_path / 'main.py').write_text('import sys\nfrom srcpkg import data as d\n')
+
+    found = sources.local_sources([tmp_path / 'main.py'], root=tmp_path)
+    assert found == [Path('main.py'), Path('srcpkg/data.py'), Path('srcpkg/util.py')]
+
+
+def test_build_datasets_parallel(build_dir, tmp_path):
+    dsdir, groups, _ = build_dir
+    serial = rebuild(dsdir, groups)
+
+    paralleldir = tmp_path / 'parallel'
+    (paralleldir / 'full').mkdir(parents=True)
+    with context_stdio(), create_executor(2, threads=True) as pool:
+        manifest = build.build_datasets([(name, None) for name in groups], paralleldir, 1, paralleldir / 'full',
+                                        mapper=pool.map)
+
+    assert manifest == serial
+    for test in serial['tests']:
+        assert (paralleldir / test).with_suffix('.out').read_text() == (dsdir / test).with_suffix('.out').read_text()
+
+
+def test_solved_datasets_streamed():
+    pulled = []
+
+    def dataset():
+        for data in ['1\n', '2\n', '3\n']:
+            pulled.append(data)
+            yield data
+
+    tests = validation.solved_datasets([('a', dataset)])
+    full_name, input_data, _, sl, output_data = next(tests)
+    assert pulled == ['1\n']
+    assert (full_name, input_data, sl, output_data) == ('"a" #1', 1, '1\n', 1)
+    assert len(list(tests)) == 2
+
+
+def test_verdict():
+    verdict = validation.Verdict()
+    verdict.check('"a" #1', 1, 3, 3)
+    verdict.check('"a" #2', 2, 5, 4)
+    verdict.check('"a" #3', 3, 8, 0)
+    assert (verdict.correct, verdict.wrong, verdict.first_full_name) == (1, 2, '"a" #2')
+
+    with pytest.raises(validation.PartiallyCorrectException, match='"a" #2'):
+        validation.assert_solutions(verdict)
+
+
+def test_assert_wrong_solutions_order():
+    failures = [
+        None,
+        validation.failure_of(validation.ValidationException('Wrong solution "b" passed all tests')),
+        validation.failure_of(validation.WrongReadException('Failed to read wrong solution "c"')),
+        validation.failure_of(validation.WrongRunException('Failed to run wrong solution "d"')),
+        validation.failure_of(validation.WrongRunException('Failed to run wrong solution "e"')),
+    ]
+    with pytest.raises(validation.ValidationException, match='Failed to run wrong solution "d"'):
+        validation.assert_wrong_solutions(['a', 'b', 'c', 'd', 'e'], failures)
+
+    validation.assert_wrong_solutions(['a'], [None])
+
+
+def test_validate_wrong_solution(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, 'find_dataset', lambda name: lambda: iter(['1\n', '2\n']))
+    monkeypatch.setattr(validation.wrongs, 'echo', lambda n: print(n), raising=False)
+    monkeypatch.setattr(validation.wrongs, 'right', lambda n: print([1, 3][n - 1]), raising=False)
+    validation.write_answer(tmp_path, 1, '1\n')
+    validation.write_answer(tmp_path, 2, '3\n')
+
+    assert validation.validate_wrong_solution(['a'], tmp_path, 'echo', limits.NO_LIMITS) is None
+    order, messages = validation.validate_wrong_solution(['a'], tmp_path, 'right', limits.NO_LIMITS)
+    assert messages == ['Wrong solution "right" passed all tests, but should fail at least one.']
+
+
+@pytest.mark.parametrize('model, f', [
+    ('n', lambda n: 5e-4 + 1e-6 * n),
+    ('n log n', lambda n: 5e-4 + 2e-7 * n * math.log(n)),
+    ('n^2', lambda n: 5e-4 + 1e-9 * n * n),
+    # super-linear, but far from quadratic
+    ('n log n', lambda n: 3e-6 + 1e-7 * n ** 1.13),
+])
+def test_fit_models_with_overhead(model, f):
+    # small sizes are dominated by the constant overhead of a call
+    sizes = [2, 6, 10, 100, 700, 1500, 3000, 5000]
+    fits = benchmark.fit_models([(n, f(n)) for n in sizes])
+    name, predict, _ = fits[0]
+    assert name == model
+    assert predict(10_000) == pytest.approx(f(10_000), rel=0.1)
+
+
+def test_fit_models_exponential():
+    fits = benchmark.fit_models([(n, 1e-6 + 1e-9 * 2 ** n) for n in [2, 5, 10, 15, 20, 25]])
+    name, predict, _ = fits[0]
+    assert name == '2^n'
+    assert predict(30) == pytest.approx(1e-6 + 1e-9 * 2 ** 30)
+    with pytest.raises(OverflowError):
+        predict(5000)
+
+
+def test_fit_models_constant():
+    fits = benchmark.fit_models([(n, 1e-3) for n in [2, 10, 100]])
+    assert all(predict(10 ** 6) == pytest.approx(1e-3) for _, predict, _ in fits)
+
+
+def test_find_dataset_names(tmp_path):
+    gen = tmp_path / 'generator.py'
+    gen.write_text('''
+import sys
+from pre_definition import tag
+from pre_definition.params import params
+from pre_definition.tag import dataset
+
+sys.exit('executed')
+
+
+@params([('n', range(3))])
+def small(n):
+    print(n)
+
+
+def helper():
+    pass
+
+
+@tag.dataset
+def huge():
+    return []
+
+
+@dataset
+def fixed():
+    @dataset
+    def nested():
+        pass
+    return []
+''')
+    assert compilation.find_dataset_names(gen) == ['small', 'huge', 'fixed']
+
+
+def test_find_dataset_names_assigned_and_imported(tmp_path, monkeypatch):
+    (tmp_path / 'dsother.py').write_text('''
+from pre_definition.tag import dataset as ds
+
+
+@ds
+def shared():
+    return []
+
+
+def helper():
+    pass
+''')
+    gen = tmp_path / 'generator.py'
+    gen.write_text('''
+from dsother import helper, shared as common
+from pre_definition.params import params as p
+from pre_definition import tag
+
+
+def _twice(n):
+    print(2 * n)
+
+
+doubled = p([('n', range(3))])(_twice)
+fixed = tag.dataset(lambda: [])
+plain = helper()
+
+
+@p([('n', range(3))])
+def small(n):
+    print(n)
+''')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sources.find_module_spec.cache_clear()
+    try:
+        assert compilation.find_dataset_names(gen) == ['common', 'doubled', 'fixed', 'small']
+    finally:
+        sources.find_module_spec.cache_clear()
+
+
+@pytest.fixture
+def local_package(tmp_path, monkeypatch):
+    pkg = tmp_path / 'localpkg'
+    pkg.mkdir()
+    (pkg / '__init__.py').write_text('')
+    (pkg / 'mod.py').write_text('VALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sources.find_module_spec.cache_clear()
+    yield pkg
+    sources.find_module_spec.cache_clear()
+
+
+def test_find_module_spec(local_package):
+    spec = sources.find_module_spec('localpkg.mod')
+    assert Path(spec.origin) == local_package / 'mod.py'
+    assert sources.find_file('localpkg') == local_package / '__init__.py'
+    # found without importing, so nothing is executed
+    assert 'localpkg' not in sys.modules and 'localpkg.mod' not in sys.modules
+
+
+def test_find_module_spec_not_found(local_package):
+    assert sources.find_module_spec('sys') is None
+    assert sources.find_module_spec('localpkg.missing') is None
+    # a module is not a package
+    assert sources.find_module_spec('localpkg.mod.VALUE') is None
+    assert sources.find_file('localpkg.missing') is None
+
+
+def test_find_module_spec_ignores_loaded_modules(local_package, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'localpkg.fake', sys)
+    assert sources.find_module_spec('localpkg.fake') is None
+
+
+def test_localize_imports(local_package):
+    local_modules = [local_package / 'mod.py']
+    tree = ast.parse('import os\n'
+                     'from localpkg.mod import VALUE\n'
+                     'from localpkg.mod import VALUE as value, VALUE as VALUE\n'
+                     'from os import path as p\n'
+                     'x = value\n')
+    statements = list(compilation.localize_imports(tree, local_modules))
+    assert [ast.unparse(stmt) for stmt in statements] == ['value = VALUE', 'x = value']
+    imports = compilation.find_nonlocal_imports(tree, local_modules)
+    assert [ast.unparse(imp) for imp in imports] == ['import os', 'from os import path as p']
+
+
+@pytest.mark.parametrize('source, names', [
+    ('a = b = 1', ['a', 'b']),
+    ('a, *b = c', ['a', 'b']),
+    ('[a, (b, *c)] = d', ['a', 'b', 'c']),
+    ('x: int', []),
+    ('x: int = 1', ['x']),
+    ('x += 1', ['x']),
+    ('x.y = 1', []),
+    ('x[0] += 1', []),
+    ('def f(): pass', ['f']),
+    ('async def f(): pass', ['f']),
+    ('class C: pass', ['C']),
+])
+def test_extract_names(source, names):
+    assert list(compilation.filter_local_names(ast.parse(source).body)) == names
+
+
+def enrich(*sources):
+    enriched = []
+    for i, source in enumerate(sources):
+        tree = ast.parse(source)
+        imps = [stmt for stmt in tree.body if isinstance(stmt, (ast.Import, ast.ImportFrom))]
+        statements = [stmt for stmt in tree.body if stmt not in imps]
+        enriched.append((f'm{i}.py', (imps, statements, set(compilation.filter_local_names(statements)))))
+    return enriched
+
+
+def unparse_enriched(enriched):
+    return [([ast.unparse(imp) for imp in imps], [ast.unparse(stmt).split('\n')[0] for stmt in statements])
+            for _, (imps, statements, _) in enriched]
+
+
+def test_shake():
+    enriched = enrich('import os\n'
+                      'from math import sqrt, floor as fl\n'
+                      'def used():\n'
+                      '    return helper() + fl(1)\n'
+                      'def helper():\n'
+                      '    return X\n'
+                      'def unused():\n'
+                      '    return os.sep + sqrt(1)\n'
+                      'X = 1\n',
+                      'import sys\n'
+                      'print(sys.argv)\n'
+                      'def root():\n'
+                      '    return used()\n')
+    assert unparse_enriched(compilation.shake(enriched, ['root'])) == [
+        (['from math import floor as fl'], ['def used():', 'def helper():', 'X = 1']),
+        (['import sys'], ['print(sys.argv)', 'def root():']),
+    ]
+
+
+@pytest.mark.parametrize('source, used, expected', [
+    ('import os.path', {'os'}, ['import os.path']),
+    ('import os.path', {'path'}, []),
+    ('import numpy as np', {'np'}, ['import numpy as np']),
+    ('import numpy as np', {'numpy'}, []),
+    ('from os import sep, path as p', {'p'}, ['from os import path as p']),
+    ('from os import sep, path as p', {'sep', 'p'}, ['from os import sep, path as p']),
+    ('from os import *', set(), ['from os import *']),
+])
+def test_shake_imports(source, used, expected):
+    assert [ast.unparse(imp) for imp in compilation.shake_imports(ast.parse(source).body, used)] == expected
+
+
+def test_merge_imports():
+    imps = ast.parse('import os\n'
+                     'from typing import List\n'
+                     'import os\n'
+                     'import numpy as np\n'
+                     'from typing import Tuple, List\n'
+                     'import numpy\n').body
+    assert [ast.unparse(imp) for imp in compilation.merge_imports(imps)] == [
+        'import os', 'from typing import List, Tuple', 'import numpy as np', 'import numpy']
+
+
+def test_strip_docstrings():
+    statements = ast.parse('"""module"""\n'
+                           'def f():\n'
+                           '    """doc"""\n'
+                           'class C:\n'
+                           '    """doc"""\n'
+                           '    def g(self):\n'
+                           '        """doc"""\n'
+                           '        return "not a doc"\n').body
+    source = ast.unparse(ast.Module(body=list(compilation.strip_docstrings(statements)), type_ignores=[]))
+    assert source == ('def f():\n'
+                      '    pass\n\n'
+                      'class C:\n\n'
+                      '    def g(self):\n'
+                      "        return 'not a doc'")
+
+
+def test_drop_blank_lines():
+    source = compilation.find_module_sourcecode(ast.parse('def f():\n'
+                                                          '    return """a\n\n    b"""\n'
+                                                          '\n\n'
+                                                          'x = 1\n').body)
+    stripped = compilation.drop_blank_lines(source)
+    assert '\n\n' not in stripped
+    namespace = {}
+    exec(stripped, namespace)
+    assert namespace['f']() == 'a\n\n    b' and namespace['x'] == 1
+
+
+class FakeStages:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.finished = []
+        self.started = dict()
+
+    def __call__(self, stage, module, argv):
+        with self.lock:
+            self.started[stage] = set(self.finished), module, argv
+        with self.lock:
+            self.finished.append(stage)
+        return (pipeline.FAILED if stage in self.failing else pipeline.PASSED), 0.0
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_run_stages_order(jobs):
+    runner = FakeStages()
+    with ThreadPoolExecutor(jobs) as pool:
+        results = pipeline.run_stages(pipeline.STAGES, {'dataset': ['-j', '2']}, pool, runner)
+
+    assert results == {stage: (pipeline.PASSED, 0.0) for stage in pipeline.STAGES}
+    for stage, (deps, module) in pipeline.STAGES.items():
+        finished, started_module, argv = runner.started[stage]
+        assert set(deps) <= finished
+        assert started_module == module
+        assert argv == (['-j', '2'] if stage == 'dataset' else [])
+
+
+def test_run_stages_skip_on_failure():
+    runner = FakeStages(failing=['validation'])
+    with ThreadPoolExecutor(2) as pool:
+        results = pipeline.run_stages(pipeline.STAGES, {}, pool, runner)
+
+    assert {stage: status for stage, (status, _) in results.items()} == {
+        'sample': pipeline.PASSED,
+        'validation': pipeline.FAILED,
+        'dataset': pipeline.SKIPPED,
+        'compilation': pipeline.PASSED,
+        'validation_my': pipeline.SKIPPED,
+    }
+    assert set(runner.started) == {'sample', 'validation', 'compilation'}
+
+
+def test_run_stages_skip_transitively():
+    stages = {'a': ([], 'a'), 'b': (['a'], 'b'), 'c': (['b'], 'c')}
+    with ThreadPoolExecutor(1) as pool:
+        results = pipeline.run_stages(stages, {}, pool, FakeStages(failing=['a']))
+    assert [results[stage][0] for stage in stages] == [pipeline.FAILED, pipeline.SKIPPED, pipeline.SKIPPED]
+
+
+def test_run_stages_cycle():
+    stages = {'a': ([], 'a'), 'b': (['c'], 'b'), 'c': (['b'], 'c')}
+    runner = FakeStages()
+    with ThreadPoolExecutor(1) as pool:
+        with pytest.raises(AssertionError, match='cyclic'):
+            pipeline.run_stages(stages, {}, pool, runner)
+    assert list(runner.started) == ['a']
+
+
+def test_shake_drops_context_stdio():
+    mdl_stdio = Path('pre_definition/stdio.py')
+    enriched = compilation.shake([(mdl_stdio, compilation.parse_module(mdl_stdio, [mdl_stdio]))], ['stdio'])
+    _, (_, statements, _) = enriched[0]
+    kept = set(compilation.filter_local_names(statements))
+    assert {'stdio', 'Std', 'context_installed'} <= kept
+    assert not kept & {'ContextStream', 'install_context_stdio', 'uninstall_context_stdio'}